@@ -1,10 +1,16 @@
 from .feature_engineering import add_date_features
 from .feature_engineering import add_text_features
+from .feature_engineering import TextEncoder
+from .feature_engineering import add_text_hash_features
 from .feature_engineering import aggregate_data
+from .feature_engineering import aggregate_windows
+from .feature_engineering import AggregationState
 from .feature_engineering import encode_factors
+from .feature_engineering import FactorEncoder
 
 from .data_cleaning import find_constant_features
 from .data_cleaning import find_correlated_features
+from .data_cleaning import CorrelationScreen
 
 from .data_processing import split_nested_features
 from .data_processing import print_missings
@@ -13,4 +19,7 @@ from .data_processing import fill_missings
 from .data_processing import print_factor_levels
 
 from .import_and_versioning import save_csv_version
+from .import_and_versioning import save_snapshot_version
+from .import_and_versioning import load_snapshot_version
+from .import_and_versioning import find_matching_version
 from .import_and_versioning import read_csv_with_json
\ No newline at end of file
@@ -5,15 +5,36 @@
 ###############################
 
 import pandas as pd
+import numpy as np
 
-def find_constant_features(df, dropna = False):
+def find_constant_features(df, 
+                           dropna     = False, 
+                           threshold  = 1, 
+                           chunk_size = 10000):
     '''
     Finds features that have just a single unique value.
 
+    The data is scanned in blocks of chunk_size rows. Each block is compared 
+    with the first value of every feature at once, and a feature is ruled 
+    out as soon as a second distinct value appears, so that the remaining 
+    rows are only scanned for features that are still constant.
+
+    With threshold < 1, finds quasi-constant features where the most frequent 
+    value accounts for at least a threshold share of the values. Value counts 
+    are accumulated over blocks, and features whose most frequent value can 
+    no longer reach the threshold in the remaining rows are ruled out early.
+
+    The data can also be passed as an iterator over pandas DF chunks, e.g. 
+    from pd.read_csv(chunksize = ...), so that wide files are screened without 
+    loading them. Constant features are screened until all features are 
+    ruled out, while quasi-constant features need all chunks.
+
     --------------------
     Arguments:
-    - df (pandas DF): dataset
+    - df (pandas DF): dataset or iterator over pandas DF chunks
     - dropna (bool): whether to treat NA as a unique value
+    - threshold (float): minimum share of the most frequent value
+    - chunk_size (int): number of rows of the dataset compared at a time
 
     --------------------
     Returns:
@@ -35,11 +56,40 @@ def find_constant_features(df, dropna = False):
     # check constant features
     from dptools import find_constant_features
     find_constant_features(df)
+
+    # check quasi-constant features
+    find_constant_features(df, threshold = 0.6)
+
+    # screen a large file in chunks
+    chunks = pd.read_csv('raw_data.csv', chunksize = 100000)
+    find_constant_features(chunks)
     '''
-    
+
+    # check parameters
+    if not 0 < threshold <= 1:
+        raise ValueError('threshold must be in (0, 1]')
+
+    # split data into chunks
+    if isinstance(df, pd.DataFrame):
+        columns = df.columns
+        n_rows  = df.shape[0]
+        chunks  = (df.iloc[i:(i + chunk_size)] for i in range(0, n_rows, chunk_size))
+    else:
+        chunks  = iter(df)
+        first   = next(chunks, None)
+        if first is None:
+            print('No constant features found.')
+            return
+        columns = first.columns
+        n_rows  = None
+        chunks  = _chain_chunks(first, chunks)
+
     # find constant features
-    constant = df.nunique(dropna = dropna) == 1
-    features = list(df.columns[constant])
+    if threshold == 1:
+        constant = _constant_mask(chunks, len(columns), dropna)
+    else:
+        constant = _quasi_constant_mask(chunks, len(columns), dropna, threshold, n_rows)
+    features = list(columns[constant])
 
     # return results
     if len(features) > 0:
@@ -49,6 +99,91 @@ def find_constant_features(df, dropna = False):
         print('No constant features found.')
 
 
+def _chain_chunks(first, chunks):
+    '''
+    Yields the first chunk followed by the remaining chunks.
+    '''
+    yield first
+    for chunk in chunks:
+        yield chunk
+
+
+def _constant_mask(chunks, n_cols, dropna = False):
+    '''
+    Returns a mask of constant features. Columns of each chunk with the same 
+    dtype are compared with their reference values as one array, and chunks 
+    are only read until all features are ruled out. Features without values 
+    are not constant, as with nunique() == 1.
+    '''
+    candidate = np.ones(n_cols, dtype = bool)
+    has_ref   = np.zeros(n_cols, dtype = bool)
+    ref       = np.full(n_cols, None, dtype = object)
+    for chunk in chunks:
+        if not candidate.any():
+            break
+        if chunk.shape[0] == 0:
+            continue
+        pos    = np.flatnonzero(candidate)
+        dtypes = chunk.dtypes.iloc[pos].astype(str).values
+        for dtype in np.unique(dtypes):
+            cols    = pos[dtypes == dtype]
+            values  = chunk.iloc[:, cols].to_numpy()
+            missing = pd.isnull(values)
+
+            # set reference values from the first row or the first non-missing row
+            first   = missing.argmin(axis = 0) if dropna else np.zeros(len(cols), dtype = np.int64)
+            new_ref = ~has_ref[cols] & ~(dropna & missing.all(axis = 0))
+            ref[cols[new_ref]] = values[first[new_ref], np.flatnonzero(new_ref)]
+            has_ref[cols[new_ref]] = True
+
+            # compare values with reference values; missing values of nullable 
+            # dtypes are replaced by None, since comparisons with pd.NA return NA
+            refs = ref[cols]
+            if values.dtype == object:
+                values = np.where(missing, None, values)
+                refs   = np.where(pd.isnull(refs), None, refs)
+            else:
+                try:
+                    refs = refs.astype(values.dtype)
+                except (TypeError, ValueError):
+                    values = values.astype(object)
+            with np.errstate(invalid = 'ignore'):
+                equal = values == refs
+            if dropna:
+                equal |= missing
+            else:
+                equal |= missing & pd.isnull(ref[cols])
+            candidate[cols[~equal.all(axis = 0)]] = False
+    return candidate & has_ref
+
+
+def _quasi_constant_mask(chunks, n_cols, dropna = False, threshold = 0.99, n_rows = None):
+    '''
+    Returns a mask of features where the most frequent value has at least a 
+    threshold share of the values. Value counts are merged over chunks. With 
+    a known number of rows, features are ruled out once the most frequent 
+    value cannot reach the threshold even if all remaining rows take it.
+    '''
+    counts = {k: pd.Series(dtype = np.float64) for k in range(n_cols)}
+    n_obs  = np.zeros(n_cols)
+    n_seen = 0
+    for chunk in chunks:
+        if len(counts) == 0:
+            break
+        n_seen += chunk.shape[0]
+        for k in list(counts):
+            chunk_counts = chunk.iloc[:, k].value_counts(dropna = dropna).astype(np.int64)
+            counts[k]    = counts[k].add(chunk_counts, fill_value = 0)
+            n_obs[k]    += chunk_counts.sum()
+            if n_rows is not None:
+                rest = n_rows - n_seen
+                if np.max(counts[k].values, initial = 0) + rest < threshold * (n_obs[k] + rest):
+                    del counts[k]
+    quasi_constant = np.zeros(n_cols, dtype = bool)
+    for k in counts:
+        quasi_constant[k] = (n_obs[k] > 0) and (counts[k].max() >= threshold * n_obs[k])
+    return quasi_constant
+
 
 ###############################
 #                             
@@ -56,18 +191,54 @@ def find_constant_features(df, dropna = False):
 #                             
 ###############################
 
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
 
-def find_correlated_features(df, cutoff = 0.9, method = 'pearson'):
+def find_correlated_features(df, 
+                             cutoff        = 0.9, 
+                             method        = 'pearson', 
+                             block_size    = None, 
+                             sample_size   = None, 
+                             sample_margin = 0.1, 
+                             random_state  = None, 
+                             n_jobs        = 1, 
+                             strategy      = 'pairs', 
+                             keep          = 'variance'):
     '''
     Finds features that have a pairwise Pearson or Spearman correlation exceeding a specified threshold. For each pair of features, only one feature is returned.
 
+    With block_size, columns are standardized once and correlations are 
+    computed in tiles of block_size features with matrix products, so that 
+    memory grows with the number of features times block_size instead of 
+    the squared number of features. Only pairs exceeding the cutoff are kept. 
+    Missing values are handled with pairwise complete observations as in 
+    pd.DataFrame.corr().
+
+    With sample_size, candidate pairs are screened on a random sample of 
+    rows with the cutoff lowered by sample_margin, and only the candidates 
+    are verified on the full data. The screening is approximate: pairs that 
+    fall below the lowered cutoff on the sample are missed.
+
+    With strategy = 'graph', correlated pairs are treated as edges of a 
+    graph and a small set of features covering all edges is dropped with a 
+    greedy vertex cover: in each cluster of correlated features, the best 
+    feature according to keep (highest variance or lowest missing rate) is 
+    kept and its neighbours are dropped. With strategy = 'pairs', the 
+    feature that comes first in the data is returned for each pair.
+
     --------------------
     Arguments:
     - df (pandas DF): dataset
     - cutoff (float): correlation threshold
     - method (string): correlation type: 'pearson', 'spearman' or both
+    - block_size (int): number of features per tile in blocked computation
+    - sample_size (int): number of rows sampled for approximate screening
+    - sample_margin (float): reduction of the cutoff for screening on the sample
+    - random_state (int): random seed for sampling rows
+    - n_jobs (int): number of threads computing tiles of correlations
+    - strategy (string): selection of features to drop: 'pairs' or 'graph'
+    - keep (string): features kept with strategy = 'graph': 'variance' or 'missing'
 
     --------------------
     Returns:
@@ -89,30 +260,359 @@ def find_correlated_features(df, cutoff = 0.9, method = 'pearson'):
     # check correlated features
     from dptools import find_correlated_features
     find_correlated_features(df, cutoff = 0.8, method = 'spearman')
+
+    # blocked computation for wide data
+    find_correlated_features(df, cutoff = 0.8, block_size = 1000)
+
+    # minimal set of features to drop
+    find_correlated_features(df, cutoff = 0.8, strategy = 'graph', keep = 'missing')
     '''
+    # check parameters
+    if strategy not in ['pairs', 'graph']:
+        raise ValueError('strategy must be \'pairs\' or \'graph\'')
+
     # extract numeric features
     numerics = [col for col in df.columns if df[col].dtype != 'object']
     df = df[numerics]
 
-    # compute correlations
-    if method == 'pearson':
-        corr_matrix = df.corr().abs()
-    if method == 'spearman':
-        corr_matrix = df.rank().corr().abs()
-    if method == 'both':
-        corr_matrix_s = df.corr().abs()
-        corr_matrix_p = df.rank().corr().abs()
-        corr_matrix   = np.maximum(corr_matrix_p, corr_matrix_s)
+    # sampled computation
+    if (sample_size is not None) and (sample_size < df.shape[0]):
+        df     = df.select_dtypes(include = ['number', 'bool'])
+        rows   = np.random.RandomState(random_state).choice(df.shape[0], sample_size, replace = False)
+        sample = _prepare_correlations(df.iloc[np.sort(rows)], method)
+        preps  = _prepare_correlations(df, method)
+        pairs  = _correlated_pairs(sample, cutoff - sample_margin, block_size or 1000, n_jobs)
+        verified = [_verify_pairs(preps, i, j, cutoff) for i, j, _ in pairs]
+        i = np.concatenate([np.zeros(0, dtype = np.int64)] + [pair[0] for pair in verified])
+        j = np.concatenate([np.zeros(0, dtype = np.int64)] + [pair[1] for pair in verified])
+        features = list(df.columns[_select_correlated(i, j, df, strategy, keep)])
+
+    # blocked computation
+    elif (block_size is not None) or (sample_size is not None) or (strategy == 'graph'):
+        screen   = CorrelationScreen(df, block_size = block_size or 1000, n_jobs = n_jobs)
+        features = screen.find(cutoff, method, strategy, keep)
+
+    # dense computation
+    else:
+
+        # compute correlations
+        if method == 'pearson':
+            corr_matrix = df.corr().abs()
+        if method == 'spearman':
+            corr_matrix = df.rank().corr().abs()
+        if method == 'both':
+            corr_matrix_s = df.corr().abs()
+            corr_matrix_p = df.rank().corr().abs()
+            corr_matrix   = np.maximum(corr_matrix_p, corr_matrix_s)
 
-    # transform to lower triangle
-    corr_lower = corr_matrix.where(np.tril(np.ones(corr_matrix.shape), k = -1).astype(np.bool))
+        # transform to lower triangle
+        corr_lower = corr_matrix.where(np.tril(np.ones(corr_matrix.shape), k = -1).astype(bool))
 
-    # remove features
-    features = [col for col in corr_lower.columns if any(corr_lower[col] > cutoff)]
+        # remove features
+        features = [col for col in corr_lower.columns if any(corr_lower[col] > cutoff)]
 
     # return results
     if len(features) > 0:
         print('Found {} correlated features.'.format(len(features)))
         return features 
     else:
-        print('No correlated features found.')
\ No newline at end of file
+        print('No correlated features found.')
+
+
+class CorrelationScreen:
+    '''
+    Screens numeric features for pairwise correlations exceeding a threshold 
+    with cached intermediate results. The standardized data and the ranks 
+    are computed once per method, and the pairs above the lowest cutoff 
+    queried so far are kept, so that queries with higher cutoffs and 
+    different methods are answered from the cache. Correlations are computed 
+    in tiles of block_size features as in find_correlated_features().
+
+    --------------------
+    Arguments:
+    - df (pandas DF): dataset
+    - block_size (int): number of features per tile
+    - n_jobs (int): number of threads computing tiles of correlations
+
+    --------------------
+    Examples:
+
+    # import dependencies
+    import pandas as pd
+    import numpy as np
+
+    # create data frame
+    data = {'age': [30, 25, 30, 35, 18], 
+        'height': [170, 168, 173, 177, 165], 
+        'weight': [71, 66, 74, 80, 60]}
+    df = pd.DataFrame(data)
+
+    # screen correlations
+    from dptools import CorrelationScreen
+    screen = CorrelationScreen(df)
+    screen.pairs(cutoff = 0.8, method = 'both')
+    screen.find(cutoff = 0.95, method = 'spearman')
+    '''
+
+    def __init__(self, 
+                 df, 
+                 block_size = 1000, 
+                 n_jobs     = 1):
+        numerics = [col for col in df.columns if df[col].dtype != 'object']
+        self.df         = df[numerics].select_dtypes(include = ['number', 'bool'])
+        self.columns    = list(self.df.columns)
+        self.block_size = block_size
+        self.n_jobs     = n_jobs
+        self.preps      = {}
+        self.cache      = {}
+
+    def pairs(self, cutoff = 0.9, method = 'pearson'):
+        '''
+        Finds pairs of features with an absolute correlation above the cutoff.
+
+        --------------------
+        Arguments:
+        - cutoff (float): correlation threshold
+        - method (string): correlation type: 'pearson', 'spearman' or both
+
+        --------------------
+        Returns:
+        - pandas DF with feature pairs and absolute correlations sorted by correlation
+        '''
+        i, j, corr = self._pairs(cutoff, method)
+        order = np.lexsort((j, i, -corr))
+        return pd.DataFrame({'feature_1': np.array(self.columns, dtype = object)[i[order]], 
+                             'feature_2': np.array(self.columns, dtype = object)[j[order]], 
+                             'corr':      corr[order]})
+
+    def find(self, cutoff = 0.9, method = 'pearson', strategy = 'pairs', keep = 'variance'):
+        '''
+        Finds correlated features to drop as in find_correlated_features().
+
+        --------------------
+        Arguments:
+        - cutoff (float): correlation threshold
+        - method (string): correlation type: 'pearson', 'spearman' or both
+        - strategy (string): selection of features to drop: 'pairs' or 'graph'
+        - keep (string): features kept with strategy = 'graph': 'variance' or 'missing'
+
+        --------------------
+        Returns:
+        - list of correlated features
+        '''
+        i, j, _    = self._pairs(cutoff, method)
+        correlated = _select_correlated(i, j, self.df, strategy, keep)
+        return [col for col, is_corr in zip(self.columns, correlated) if is_corr]
+
+    def _pairs(self, cutoff, method):
+        '''
+        Returns the earlier features, the later features and the absolute 
+        correlations of pairs above the cutoff. Pairs of both methods are 
+        merged with the maximum correlation.
+        '''
+        if method not in ['pearson', 'spearman', 'both']:
+            raise ValueError('method must be \'pearson\', \'spearman\' or \'both\'')
+        if method != 'both':
+            return self._method_pairs(cutoff, method)
+        i, j, corr = [np.concatenate(arrays) for arrays in zip(self._method_pairs(cutoff, 'pearson'), 
+                                                                   self._method_pairs(cutoff, 'spearman'))]
+        keys, inverse = np.unique(i * len(self.columns) + j, return_inverse = True)
+        max_corr = np.zeros(len(keys))
+        np.maximum.at(max_corr, inverse, corr)
+        return keys // len(self.columns), keys % len(self.columns), max_corr
+
+    def _method_pairs(self, cutoff, method):
+        '''
+        Returns pairs above the cutoff for a single method. Pairs are computed 
+        only if the cutoff is below the lowest cutoff in the cache.
+        '''
+        if (method not in self.cache) or (cutoff < self.cache[method][0]):
+            if method not in self.preps:
+                X = self.df.values if method == 'pearson' else self.df.rank().values
+                self.preps[method] = _standardize(X.astype(np.float64))
+            pairs = list(_correlated_pairs([self.preps[method]], cutoff, self.block_size, self.n_jobs))
+            if len(pairs) > 0:
+                i, j, corr = [np.concatenate(arrays) for arrays in zip(*pairs)]
+            else:
+                i, j, corr = np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64), np.zeros(0)
+            self.cache[method] = (cutoff, i, j, corr)
+        _, i, j, corr = self.cache[method]
+        keep = corr > cutoff
+        return i[keep], j[keep], corr[keep]
+
+
+def _select_correlated(i, j, df, strategy = 'pairs', keep = 'variance'):
+    '''
+    Returns a mask of features to drop given pairs of correlated features 
+    i < j. With strategy = 'pairs', the earlier feature of each pair is 
+    dropped. With strategy = 'graph', features are dropped with a greedy 
+    vertex cover that keeps the best ranked features.
+    '''
+    if strategy not in ['pairs', 'graph']:
+        raise ValueError('strategy must be \'pairs\' or \'graph\'')
+    if strategy == 'pairs':
+        correlated = np.zeros(df.shape[1], dtype = bool)
+        correlated[i] = True
+        return correlated
+    return _greedy_vertex_cover(i, j, _feature_ranks(df, keep))
+
+
+def _feature_ranks(df, keep = 'variance'):
+    '''
+    Ranks features from best to worst by highest variance or lowest missing 
+    rate. Ties are broken by the order of the columns.
+    '''
+    if keep not in ['variance', 'missing']:
+        raise ValueError('keep must be \'variance\' or \'missing\'')
+    if keep == 'variance':
+        score = -df.var().values.astype(np.float64)
+        score = np.where(np.isnan(score), np.inf, score)
+    else:
+        score = df.isnull().mean().values
+    order = np.lexsort((np.arange(df.shape[1]), score))
+    ranks = np.empty(df.shape[1], dtype = np.int64)
+    ranks[order] = np.arange(df.shape[1])
+    return ranks
+
+
+def _greedy_vertex_cover(i, j, ranks):
+    '''
+    Drops a set of features covering all pairs of correlated features. In 
+    each round, every undecided feature that is ranked better than all of 
+    its undecided neighbours is kept and its neighbours are dropped, which 
+    gives the same result as keeping features one by one in order of rank.
+    '''
+    undecided, kept, dropped = 0, 1, 2
+    state = np.zeros(len(ranks), dtype = np.int8)
+    u, v  = np.concatenate([i, j]), np.concatenate([j, i])
+    state[np.setdiff1d(np.arange(len(ranks)), u)] = kept
+    while len(u) > 0:
+        best = ranks.copy()
+        np.minimum.at(best, u, ranks[v])
+        is_best = (state == undecided) & (best == ranks)
+        state[is_best] = kept
+        state[v[is_best[u]]] = dropped
+        active = (state[u] == undecided) & (state[v] == undecided)
+        u, v   = u[active], v[active]
+    state[state == undecided] = kept
+    return state == dropped
+
+
+def _prepare_correlations(df, method = 'pearson'):
+    '''
+    Standardizes the columns of the data or their ranks for correlation 
+    tiles. Returns one prepared matrix for Pearson or Spearman correlation 
+    and two for both.
+    '''
+    if method not in ['pearson', 'spearman', 'both']:
+        raise ValueError('method must be \'pearson\', \'spearman\' or \'both\'')
+    mats = []
+    if method in ['pearson', 'both']:
+        mats.append(df.values.astype(np.float64))
+    if method in ['spearman', 'both']:
+        mats.append(df.rank().values.astype(np.float64))
+    return [_standardize(X) for X in mats]
+
+
+def _standardize(X):
+    '''
+    Centers and scales columns so that correlations are inner products. With 
+    missing values, keeps the centered values, their squares and the mask 
+    of observed values to compute correlations over pairwise complete rows.
+    '''
+    is_obs = ~np.isnan(X)
+    if is_obs.all():
+        Z     = X - X.mean(axis = 0)
+        norms = np.sqrt(np.einsum('ij,ij->j', Z, Z))
+        Z    /= np.where(norms > 0, norms, np.inf)
+        return {'z': Z}
+    with np.errstate(invalid = 'ignore'):
+        means = np.nanmean(X, axis = 0)
+    X0 = np.where(is_obs, X - np.nan_to_num(means), 0)
+    return {'x': X0, 'xx': X0 ** 2, 'm': is_obs.astype(np.float64)}
+
+
+def _correlation_tile(prep, a0, a1, b0, b1):
+    '''
+    Computes absolute correlations between features a0:a1 and b0:b1 with 
+    matrix products. Undefined correlations are set to 0.
+    '''
+    if 'z' in prep:
+        return np.abs(prep['z'][:, a0:a1].T @ prep['z'][:, b0:b1])
+    x, xx, m = prep['x'], prep['xx'], prep['m']
+    n   = m[:, a0:a1].T @ m[:, b0:b1]
+    sx  = x[:, a0:a1].T @ m[:, b0:b1]
+    sy  = m[:, a0:a1].T @ x[:, b0:b1]
+    sxx = xx[:, a0:a1].T @ m[:, b0:b1]
+    syy = m[:, a0:a1].T @ xx[:, b0:b1]
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        cov   = x[:, a0:a1].T @ x[:, b0:b1] - sx * sy / n
+        var_x = sxx - sx ** 2 / n
+        var_y = syy - sy ** 2 / n
+        corr  = np.abs(cov / np.sqrt(var_x * var_y))
+    return np.where((var_x > 1e-12 * sxx) & (var_y > 1e-12 * syy), np.minimum(corr, 1), 0)
+
+
+def _correlated_pairs(preps, cutoff, block_size, n_jobs = 1):
+    '''
+    Streams pairs of features with an absolute correlation above the cutoff. 
+    Correlations of a block of features with all later features are computed 
+    in one tile. With n_jobs > 1, tiles are computed in a thread pool, as 
+    matrix products release the GIL. Yields arrays of the earlier features, 
+    the later features and the correlations per tile.
+    '''
+    p      = list(preps[0].values())[0].shape[1]
+    blocks = range(0, p, block_size)
+    tile_pairs = lambda a0: _tile_pairs(preps, a0, min(a0 + block_size, p), cutoff)
+    if n_jobs > 1:
+        with ThreadPoolExecutor(max_workers = n_jobs) as pool:
+            yield from pool.map(tile_pairs, blocks)
+    else:
+        yield from map(tile_pairs, blocks)
+
+
+def _tile_pairs(preps, a0, a1, cutoff):
+    '''
+    Finds pairs of features a0:a1 and later features with an absolute 
+    correlation above the cutoff.
+    '''
+    p    = list(preps[0].values())[0].shape[1]
+    tile = _correlation_tile(preps[0], a0, a1, a0, p)
+    for prep in preps[1:]:
+        tile = np.maximum(tile, _correlation_tile(prep, a0, a1, a0, p))
+    tile[np.tril_indices(a1 - a0, m = p - a0)] = 0
+    i, j = np.nonzero(tile > cutoff)
+    return i + a0, j + a0, tile[i, j]
+
+
+def _verify_pairs(preps, i, j, cutoff, batch_size = 10000):
+    '''
+    Computes exact absolute correlations of candidate pairs of features and 
+    keeps the pairs above the cutoff.
+    '''
+    corr = np.zeros(len(i))
+    for b in range(0, len(i), batch_size):
+        I, J = i[b:(b + batch_size)], j[b:(b + batch_size)]
+        for prep in preps:
+            corr[b:(b + batch_size)] = np.maximum(corr[b:(b + batch_size)], _pair_correlations(prep, I, J))
+    keep = corr > cutoff
+    return i[keep], j[keep], corr[keep]
+
+
+def _pair_correlations(prep, I, J):
+    '''
+    Computes absolute correlations of pairs of features I and J.
+    '''
+    if 'z' in prep:
+        return np.abs(np.einsum('ij,ij->j', prep['z'][:, I], prep['z'][:, J]))
+    x, xx, m = prep['x'], prep['xx'], prep['m']
+    m_ij = m[:, I] * m[:, J]
+    n    = m_ij.sum(axis = 0)
+    sx,  sy  = (x[:, I] * m_ij).sum(axis = 0), (x[:, J] * m_ij).sum(axis = 0)
+    sxx, syy = (xx[:, I] * m_ij).sum(axis = 0), (xx[:, J] * m_ij).sum(axis = 0)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        cov   = (x[:, I] * x[:, J]).sum(axis = 0) - sx * sy / n
+        var_x = sxx - sx ** 2 / n
+        var_y = syy - sy ** 2 / n
+        corr  = np.abs(cov / np.sqrt(var_x * var_y))
+    return np.where((var_x > 1e-12 * sxx) & (var_y > 1e-12 * syy), np.minimum(corr, 1), 0)
@@ -4,23 +4,49 @@
 #                             
 ###############################
 
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
 import re
 
 def add_date_features(df, 
                       date_vars, 
-                      drop = True, 
-                      time = False):
+                      drop          = True, 
+                      time          = False, 
+                      fast          = False, 
+                      holidays      = None, 
+                      business_days = False, 
+                      cyclical      = False, 
+                      n_jobs        = 1, 
+                      copy          = True):
     '''
     Adds basic date-based features based to the data frame.
 
+    Optional holiday, business day and cyclical features are computed in 
+    lookup tables over the days covered by the data and gathered by day 
+    number. Business days exclude weekends and holidays. Cyclical features 
+    encode the month, day of week, day of year and hour (if time = True) as 
+    sine and cosine.
+
+    With fast = True, only unique date strings are parsed and broadcast back 
+    to the rows. All date attributes are then computed from a single array of 
+    epoch nanoseconds with NumPy arithmetic, and the new features of all date 
+    columns are added to the data frame in a single concat. Date columns can 
+    be processed in a thread pool with n_jobs > 1.
+
     --------------------
     Arguments:
     - df (pandas DF): dataset
     - date_var (str): name of the date feature
     - drop (bool): whether to drop the original date feature
     - time (bool): whether to include time-based features
+    - fast (bool): whether to parse unique dates and compute features from epoch arrays
+    - holidays (list): list of holiday dates or pandas holiday calendar for holiday flags and days to the next holiday
+    - business_days (bool): whether to include business day flags and business day counts within the month
+    - cyclical (bool): whether to include sine and cosine encodings of periodic attributes
+    - n_jobs (int): number of threads computing features of date columns if fast = True
+    - copy (bool): whether to copy the data; otherwise new features are added to df in place 
+      or, if fast = True, the result shares the data of df
 
     --------------------
     Returns:
@@ -39,18 +65,50 @@ def add_date_features(df,
     # add date features
     from dptools import add_date_features
     df_new = add_date_features(df, date_vars = 'date_of_birth')
+
+    # add holiday and cyclical features
+    from pandas.tseries.holiday import USFederalHolidayCalendar
+    df_new = add_date_features(df, date_vars = 'date_of_birth', holidays = USFederalHolidayCalendar(), 
+                               business_days = True, cyclical = True)
     '''
     
-    # copy df
-    df_new = df.copy()
-    
     # store no. features
-    n_feats = df_new.shape[1]
+    n_feats = df.shape[1]
 
     # convert to list
     if not isinstance(date_vars, list):
         date_vars = [date_vars]
 
+    # vectorized features
+    if fast:
+
+        # compute features
+        compute = lambda date_var: _date_features(df[date_var], re.sub('[Dd]ate$', '', date_var), 
+                                                  time, holidays, business_days, cyclical)
+        if n_jobs > 1:
+            with ThreadPoolExecutor(max_workers = n_jobs) as pool:
+                results = list(pool.map(compute, date_vars))
+        else:
+            results = [compute(date_var) for date_var in date_vars]
+        feats = pd.DataFrame({f: values for _, var_feats in results for f, values in var_feats.items()}, 
+                             index = df.index)
+
+        # attach features in one block
+        existing = [f for f in feats.columns if f in df.columns]
+        df_new   = pd.concat([df, feats.drop(existing, axis = 1)], axis = 1, copy = copy)
+        for f in existing:
+            df_new[f] = feats[f]
+        for date_var, (var, _) in zip(date_vars, results):
+            if drop:
+                del df_new[date_var]
+            elif var.dtype != df[date_var].dtype:
+                df_new[date_var] = var
+        print('Added {} date-based features.'.format(df_new.shape[1] - n_feats + int(drop) * len(date_vars)))
+        return df_new
+
+    # copy df
+    df_new = df.copy() if copy else df
+
     # feature engineering loop
     for date_var in date_vars:
 
@@ -74,13 +132,19 @@ def add_date_features(df,
         
         # list of time attributes
         if time: 
-            attributes = attributes + ['Hour', 'Minute', 'Second']
+            attributes = attributes + ['hour', 'minute', 'second']
             
         # compute features
         for att in attributes: 
             df_new[targ_pre + '_' + att.lower()] = getattr(var.dt, att)
 
         df_new[targ_pre + '_elapsed'] = var.astype(np.int64) // 10 ** 9
+
+        # compute lookup features
+        if (holidays is not None) or business_days or cyclical:
+            lookups = _date_lookup_features(var, targ_pre, time, holidays, business_days, cyclical)
+            for feat, values in lookups.items():
+                df_new[feat] = values
         
         # remove original feature
         if drop: 
@@ -91,6 +155,207 @@ def add_date_features(df,
     return df_new
 
 
+def _date_features(var, 
+                   targ_pre, 
+                   time          = False, 
+                   holidays      = None, 
+                   business_days = False, 
+                   cyclical      = False):
+    '''
+    Parses a date feature and computes all its date-based features. Returns 
+    the parsed feature and a dict of features.
+    '''
+    var   = _parse_unique_dates(var)
+    feats = _date_attributes(var, targ_pre, time)
+    if (holidays is not None) or business_days or cyclical:
+        feats.update(_date_lookup_features(var, targ_pre, time, holidays, business_days, cyclical))
+    return var, feats
+
+
+def _parse_unique_dates(var):
+    '''
+    Converts a feature to datetime by parsing each unique value once.
+    '''
+
+    # check dtype
+    if isinstance(var.dtype, pd.core.dtypes.dtypes.DatetimeTZDtype) or np.issubdtype(var.dtype, np.datetime64):
+        return var
+
+    # parse unique values
+    codes, uniques = pd.factorize(var)
+    parsed = pd.to_datetime(pd.Series(uniques), infer_datetime_format = True)
+    values = parsed.take(np.where(codes >= 0, codes, 0)).values
+    if (codes < 0).any():
+        values[codes < 0] = np.datetime64('NaT')
+    return pd.Series(values, index = var.index, name = var.name)
+
+
+def _days_from_civil(year, month, day):
+    '''
+    Converts proleptic Gregorian dates to days since 1970-01-01.
+    '''
+    year = year - (month <= 2)
+    era  = np.floor_divide(year, 400)
+    yoe  = year - era * 400
+    doy  = (153 * (month + np.where(month > 2, -3, 9)) + 2) // 5 + day - 1
+    doe  = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def _civil_from_days(days):
+    '''
+    Converts days since 1970-01-01 to proleptic Gregorian year, month and day.
+    '''
+    days  = days + 719468
+    era   = np.floor_divide(days, 146097)
+    doe   = days - era * 146097
+    yoe   = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy   = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp    = (5 * doy + 2) // 153
+    day   = doy - (153 * mp + 2) // 5 + 1
+    month = mp + np.where(mp < 10, 3, -9)
+    return yoe + era * 400 + (month <= 2), month, day
+
+
+def _local_days(var):
+    '''
+    Returns epoch nanoseconds and day numbers in local time of a datetime 
+    feature and the mask of missing dates.
+    '''
+    values = var.values
+    if isinstance(var.dtype, pd.core.dtypes.dtypes.DatetimeTZDtype):
+        values = var.dt.tz_localize(None).values
+    is_nat = np.isnat(values)
+    nanos  = np.where(is_nat, 0, values.view(np.int64))
+    return nanos, np.floor_divide(nanos, 86400 * 10 ** 9), is_nat
+
+
+def _mask_missing_dates(feats, is_nat):
+    '''
+    Sets features of missing dates to False for flags and NA otherwise.
+    '''
+    for att, values in feats.items():
+        if values.dtype == bool:
+            feats[att] = values & ~is_nat
+        elif is_nat.any():
+            feats[att] = np.where(is_nat, np.nan, values)
+    return feats
+
+
+def _date_attributes(var, targ_pre, time = False):
+    '''
+    Computes date attributes from epoch nanoseconds. Attributes match the 
+    pandas datetime accessor, including local time of tz-aware dates.
+    '''
+
+    # calendar attributes
+    nanos, days, is_nat = _local_days(var)
+    year, month, day = _civil_from_days(days)
+    dayofweek = (days + 3) % 7
+    dayofyear = days - _days_from_civil(year, 1, 1) + 1
+    thursday  = days - dayofweek + 3
+    week      = (thursday - _days_from_civil(_civil_from_days(thursday)[0], 1, 1)) // 7 + 1
+    month_end = day == (_days_from_civil(year + (month == 12), month % 12 + 1, 1) - days + day - 1)
+    quarter   = (month - 1) % 3
+
+    # compute features
+    feats = {'year': year, 'month': month, 'week': week, 'day': day, 
+             'dayofweek': dayofweek, 'dayofyear': dayofyear, 
+             'is_month_end': month_end, 'is_month_start': day == 1, 
+             'is_quarter_end': month_end & (quarter == 2), 'is_quarter_start': (day == 1) & (quarter == 0), 
+             'is_year_end': (month == 12) & (day == 31), 'is_year_start': (month == 1) & (day == 1)}
+    if time:
+        seconds = (nanos - days * 86400 * 10 ** 9) // 10 ** 9
+        feats.update({'hour': seconds // 3600, 'minute': seconds // 60 % 60, 'second': seconds % 60})
+
+    # mask missing dates
+    feats = _mask_missing_dates(feats, is_nat)
+    feats = {targ_pre + '_' + att: values for att, values in feats.items()}
+    feats[targ_pre + '_elapsed'] = var.astype(np.int64).values // 10 ** 9
+    return feats
+
+
+def _date_lookup_features(var, 
+                          targ_pre, 
+                          time          = False, 
+                          holidays      = None, 
+                          business_days = False, 
+                          cyclical      = False):
+    '''
+    Computes holiday, business day and cyclical features. Features are 
+    precomputed in lookup tables over the range of day numbers covered by 
+    the data, so that each feature is a single gather by day number.
+    '''
+
+    # day range
+    nanos, days, is_nat = _local_days(var)
+    first, last = (days[~is_nat].min(), days[~is_nat].max()) if (~is_nat).any() else (0, 0)
+    year, month, day = _civil_from_days(np.array([first, last]))
+    first = _days_from_civil(year[0], month[0], 1)
+    last  = _days_from_civil(year[1] + (month[1] == 12), month[1] % 12 + 1, 1) - 1
+    table_days = np.arange(first, last + 1)
+    tables = {}
+
+    # holiday features
+    if (holidays is not None) or business_days:
+        holiday_days = _holiday_days(holidays, first, last)
+        is_holiday   = np.isin(table_days, holiday_days)
+    if holidays is not None:
+        next_holiday = np.searchsorted(holiday_days, table_days)
+        has_next     = next_holiday < len(holiday_days)
+        days_to_next = np.full(len(table_days), np.nan)
+        days_to_next[has_next] = holiday_days[next_holiday[has_next]] - table_days[has_next]
+        tables['is_holiday']      = is_holiday
+        tables['days_to_holiday'] = days_to_next
+
+    # business day features
+    if business_days:
+        is_bday     = ((table_days + 3) % 7 < 5) & ~is_holiday
+        cum_bdays   = np.concatenate([[0], np.cumsum(is_bday)])
+        t_year, t_month, t_day = _civil_from_days(table_days)
+        month_first = table_days - t_day + 1
+        month_last  = _days_from_civil(t_year + (t_month == 12), t_month % 12 + 1, 1) - 1
+        tables['is_business_day']            = is_bday
+        tables['business_day_of_month']      = cum_bdays[table_days - first + 1] - cum_bdays[month_first - first]
+        tables['business_days_to_month_end'] = cum_bdays[month_last - first + 1] - cum_bdays[table_days - first + 1]
+
+    # cyclical features
+    if cyclical:
+        t_year, t_month, _ = _civil_from_days(table_days)
+        year_len  = _days_from_civil(t_year + 1, 1, 1) - _days_from_civil(t_year, 1, 1)
+        angles    = {'month':     (t_month - 1) / 12, 
+                     'dayofweek': ((table_days + 3) % 7) / 7, 
+                     'dayofyear': (table_days - _days_from_civil(t_year, 1, 1)) / year_len}
+        for att, angle in angles.items():
+            tables[att + '_sin'] = np.sin(2 * np.pi * angle)
+            tables[att + '_cos'] = np.cos(2 * np.pi * angle)
+
+    # gather features
+    index = np.where(is_nat, 0, days - first)
+    feats = {att: table[index] for att, table in tables.items()}
+    if cyclical and time:
+        hours = ((nanos - days * 86400 * 10 ** 9) / (3600 * 10 ** 9)) / 24
+        feats['hour_sin'] = np.sin(2 * np.pi * hours)
+        feats['hour_cos'] = np.cos(2 * np.pi * hours)
+    feats = _mask_missing_dates(feats, is_nat)
+    return {targ_pre + '_' + att: values for att, values in feats.items()}
+
+
+def _holiday_days(holidays, first, last):
+    '''
+    Converts a list of holidays or a pandas holiday calendar to sorted unique 
+    day numbers. Calendar holidays are generated up to a year after the last 
+    date to find the next holiday.
+    '''
+    if holidays is None:
+        holidays = []
+    elif hasattr(holidays, 'holidays'):
+        to_date  = lambda d: pd.Timestamp(np.datetime64(int(d), 'D'))
+        holidays = holidays.holidays(start = to_date(first), end = to_date(last + 366))
+    holidays = pd.to_datetime(list(holidays)).dropna()
+    return np.unique(holidays.values.astype('datetime64[D]').view(np.int64))
+
+
 
 ###############################
 #                             
@@ -98,21 +363,36 @@ def add_date_features(df,
 #                             
 ###############################
 
+from concurrent.futures import ProcessPoolExecutor
+import collections
+import os
+import numpy as np
 import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer, CountVectorizer
+import pickle
+import re
+from sklearn.feature_extraction.text import TfidfVectorizer, CountVectorizer, HashingVectorizer, ENGLISH_STOP_WORDS
 import scipy.sparse
 
 def add_text_features(df, 
                       text_vars, 
-                      tf_idf_feats = 5, 
-                      common_words = 0,
-                      rare_words   = 0,
-                      ngram_range  = (1, 1),
-                      drop         = True):
+                      tf_idf_feats      = 5, 
+                      common_words      = 0,
+                      rare_words        = 0,
+                      ngram_range       = (1, 1),
+                      drop              = True, 
+                      text_stats        = False, 
+                      char_tf_idf_feats = 0, 
+                      char_ngram_range  = (2, 4), 
+                      n_jobs            = 1):
     '''
     Adds basic text-based features including word count, character count and 
     TF-IDF based features to the data frame.
 
+    Optional text statistics include the unique word ratio, the average word 
+    length and the ratios of uppercase, digit and punctuation characters. 
+    They are computed in a single scan over the code points of all documents.
+    Character n-gram TF-IDF features are built from the cleaned text.
+
     --------------------
     Arguments:
     - df (pandas DF): dataset
@@ -122,6 +402,10 @@ def add_text_features(df,
     - rare_words (int): number of the most rare words to remove for TF-IDF
     - ngram_range (int, int): range of n-grams for TF-IDF based features
     - drop (bool): whether to drop the original textual features
+    - text_stats (bool): whether to include word and character statistics
+    - char_tf_idf_feats (int): number of character n-gram TF-IDF based features
+    - char_ngram_range (int, int): range of character n-grams
+    - n_jobs (int): number of worker processes computing text statistics in chunks of documents
 
     --------------------
     Returns:
@@ -145,60 +429,600 @@ def add_text_features(df,
     from dptools import add_text_features
     df_new = add_text_features(df, text_vars = ['income', 'gender'])
     '''
-    # copy df
-    df_new = df.copy()
-
     # store no. features
-    n_feats = df_new.shape[1]
+    n_feats = df.shape[1]
 
     # convert to list
     if not isinstance(text_vars, list):
         text_vars = [text_vars]
 
-    # feature engineering loop
-    for text_var in text_vars:
+    # fit and apply encoder
+    encoder = TextEncoder(text_vars         = text_vars, 
+                          tf_idf_feats      = tf_idf_feats, 
+                          common_words      = common_words, 
+                          rare_words        = rare_words, 
+                          ngram_range       = ngram_range, 
+                          text_stats        = text_stats, 
+                          char_tf_idf_feats = char_tf_idf_feats, 
+                          char_ngram_range  = char_ngram_range, 
+                          n_jobs            = n_jobs)
+    df_new = encoder.fit_transform(df, drop = drop)
+        
+    # return results
+    print('Added {} text-based features.'.format(df_new.shape[1] - n_feats + int(drop) * len(text_vars)))
+    return df_new
 
-        # replace NA with empty string
-        df_new[text_var].fillna('', inplace = True)
 
-        # remove common and rare words
-        freq = pd.Series(' '.join(df_new[text_var]).split()).value_counts()[:common_words]
-        freq = pd.Series(' '.join(df_new[text_var]).split()).value_counts()[-rare_words:]
+class TextEncoder:
+    '''
+    Creates text-based features including word count, character count and 
+    TF-IDF based features with vocabularies and IDF weights learned on 
+    training data. The fitted vectorizers are applied to new data with 
+    transform(), so that all batches get the same TF-IDF features without 
+    refitting. The encoder can be saved as a pickle file.
 
-        # convert to lowercase 
-        df_new[text_var] = df_new[text_var].apply(lambda x: ' '.join(x.lower() for x in x.split())) 
+    --------------------
+    Arguments:
+    - text_vars (list): list of textual features
+    - tf_idf_feats (int): number of TF-IDF based features
+    - common_words (int): number of the most common words to remove for TF-IDF
+    - rare_words (int): number of the most rare words to remove for TF-IDF
+    - ngram_range (int, int): range of n-grams for TF-IDF based features
+    - text_stats (bool): whether to include word and character statistics
+    - char_tf_idf_feats (int): number of character n-gram TF-IDF based features
+    - char_ngram_range (int, int): range of character n-grams
+    - n_jobs (int): number of worker processes computing text statistics in chunks of documents
 
-        # remove punctuation
-        df_new[text_var] = df_new[text_var].str.replace('[^\w\s]','')         
+    --------------------
+    Examples:
 
-        # word count
-        df_new[text_var + '_word_count'] = df_new[text_var].apply(lambda x: len(str(x).split(' ')))
-        df_new[text_var + '_word_count'][df_new[text_var] == ''] = 0
+    # import dependencies
+    import pandas as pd
 
-        # character count
-        df_new[text_var + '_char_count'] = df_new[text_var].str.len().fillna(0).astype('int64')
+    # create data frames
+    train = pd.DataFrame({'review': ['Great product!', 'Bad quality, would not buy', 'great value']})
+    test  = pd.DataFrame({'review': ['Great quality', 'not great']})
 
-        # import vectorizer
-        tfidf  = TfidfVectorizer(max_features = tf_idf_feats, 
-                                 lowercase    = True, 
-                                 norm         = 'l2', 
-                                 analyzer     = 'word', 
-                                 stop_words   = 'english', 
-                                 ngram_range  = ngram_range)
+    # learn and apply features
+    from dptools import TextEncoder
+    encoder   = TextEncoder(text_vars = 'review', tf_idf_feats = 10)
+    train_enc = encoder.fit_transform(train)
+    test_enc  = encoder.transform(test)
 
-        # compute TF-IDF
-        vals = tfidf.fit_transform(df_new[text_var])
-        vals = pd.DataFrame.sparse.from_spmatrix(vals)
-        vals.columns = [text_var + '_tfidf_' + str(p) for p in vals.columns]
-        df_new = pd.concat([df_new, vals], axis = 1)
+    # sparse matrix with TF-IDF features
+    X = encoder.transform_sparse(test)
 
-        # remove original feature
+    # save and load encoder
+    encoder.save('encoder.pkl')
+    encoder = TextEncoder.load('encoder.pkl')
+    '''
+
+    def __init__(self, 
+                 text_vars, 
+                 tf_idf_feats      = 5, 
+                 common_words      = 0, 
+                 rare_words        = 0, 
+                 ngram_range       = (1, 1), 
+                 text_stats        = False, 
+                 char_tf_idf_feats = 0, 
+                 char_ngram_range  = (2, 4), 
+                 n_jobs            = 1):
+        if not isinstance(text_vars, list):
+            text_vars = [text_vars]
+        self.text_vars         = text_vars
+        self.tf_idf_feats      = tf_idf_feats
+        self.common_words      = common_words
+        self.rare_words        = rare_words
+        self.ngram_range       = ngram_range
+        self.text_stats        = text_stats
+        self.char_tf_idf_feats = char_tf_idf_feats
+        self.char_ngram_range  = char_ngram_range
+        self.n_jobs            = n_jobs
+        self.vectorizers       = None
+        self.char_vectorizers  = None
+
+    def fit(self, df):
+        '''
+        Learns the vocabularies and IDF weights of textual features.
+
+        --------------------
+        Arguments:
+        - df (pandas DF): training data
+
+        --------------------
+        Returns:
+        - fitted encoder
+        '''
+        self.vectorizers, self.char_vectorizers = {}, {}
+        for text_var in self.text_vars:
+            text, tokens = _clean_text(df[text_var], tokens = True)
+            self.vectorizers[text_var] = self._fit_vectorizer(text, tokens)[0]
+            if self.char_tf_idf_feats > 0:
+                self.char_vectorizers[text_var] = self._char_vectorizer().fit(text)
+        return self
+
+    def transform(self, df, drop = True):
+        '''
+        Adds text-based features to new data.
+
+        --------------------
+        Arguments:
+        - df (pandas DF): data to encode
+        - drop (bool): whether to drop the original textual features
+
+        --------------------
+        Returns:
+        - pandas DF with new features
+        '''
+        if self.vectorizers is None:
+            raise ValueError('TextEncoder must be fitted before transform()')
+        return self._add_features(df, drop, fit = False)
+
+    def fit_transform(self, df, drop = True):
+        '''
+        Learns the vocabularies and IDF weights and adds text-based features 
+        to the training data.
+
+        --------------------
+        Arguments:
+        - df (pandas DF): training data
+        - drop (bool): whether to drop the original textual features
+
+        --------------------
+        Returns:
+        - pandas DF with new features
+        '''
+        self.vectorizers, self.char_vectorizers = {}, {}
+        return self._add_features(df, drop, fit = True)
+
+    def transform_sparse(self, df):
+        '''
+        Computes the TF-IDF features of new data as a sparse matrix. Columns 
+        are ordered by textual features with word TF-IDF features followed 
+        by character n-gram TF-IDF features.
+
+        --------------------
+        Arguments:
+        - df (pandas DF): data to encode
+
+        --------------------
+        Returns:
+        - scipy.sparse CSR matrix with TF-IDF features
+        '''
+        if self.vectorizers is None:
+            raise ValueError('TextEncoder must be fitted before transform_sparse()')
+        vals = []
+        for text_var in self.text_vars:
+            text = _clean_text(df[text_var])
+            vals.append(self.vectorizers[text_var].transform(text))
+            if text_var in self.char_vectorizers:
+                vals.append(self.char_vectorizers[text_var].transform(text))
+        return scipy.sparse.hstack(vals, format = 'csr')
+
+    def get_feature_names(self):
+        '''
+        Returns the names of text-based features.
+
+        --------------------
+        Returns:
+        - list of feature names
+        '''
+        names = []
+        for text_var, vectorizer in self.vectorizers.items():
+            names += [text_var + '_word_count', text_var + '_char_count']
+            if self.text_stats:
+                names += [text_var + '_' + stat for stat in _TEXT_STATS]
+            names += [text_var + '_tfidf_' + str(p) for p in range(len(vectorizer.vocabulary_))]
+            if text_var in self.char_vectorizers:
+                names += [text_var + '_char_tfidf_' + str(p) for p in range(len(self.char_vectorizers[text_var].vocabulary_))]
+        return names
+
+    def save(self, file_path):
+        '''
+        Saves the fitted encoder as a pickle file.
+
+        --------------------
+        Arguments:
+        - file_path (str): file path including the file name
+        '''
+        with open(file_path, 'wb') as f:
+            pickle.dump(self.__dict__, f, protocol = pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, file_path):
+        '''
+        Loads an encoder saved with save().
+
+        --------------------
+        Arguments:
+        - file_path (str): file path including the file name
+
+        --------------------
+        Returns:
+        - fitted encoder
+        '''
+        with open(file_path, 'rb') as f:
+            state = pickle.load(f)
+        encoder = cls(text_vars = state['text_vars'])
+        encoder.__dict__.update(state)
+        return encoder
+
+    def _fit_vectorizer(self, text, tokens):
+        '''
+        Fits a TF-IDF vectorizer on cleaned text. The most common and the 
+        most rare words in the frequency table of the tokens are added to 
+        the stop words. Returns the fitted vectorizer and the TF-IDF matrix.
+        '''
+        stop_words = 'english'
+        if (self.common_words > 0) or (self.rare_words > 0):
+            freq = _word_frequencies(tokens)
+            stop_words = set(freq.index[:self.common_words])
+            if self.rare_words > 0:
+                stop_words |= set(freq.index[-self.rare_words:])
+            stop_words = sorted(stop_words | ENGLISH_STOP_WORDS)
+        vectorizer = TfidfVectorizer(max_features = self.tf_idf_feats, 
+                                     lowercase    = True, 
+                                     norm         = 'l2', 
+                                     analyzer     = 'word', 
+                                     stop_words   = stop_words, 
+                                     ngram_range  = self.ngram_range)
+        return vectorizer, vectorizer.fit_transform(text)
+
+    def _char_vectorizer(self):
+        '''
+        Creates an unfitted character n-gram TF-IDF vectorizer.
+        '''
+        return TfidfVectorizer(max_features = self.char_tf_idf_feats, 
+                               lowercase    = True, 
+                               norm         = 'l2', 
+                               analyzer     = 'char_wb', 
+                               ngram_range  = self.char_ngram_range)
+
+    def _add_features(self, df, drop, fit):
+        '''
+        Cleans textual features and adds counts and TF-IDF features in a 
+        single concat.
+        '''
+        df_new = df.copy()
+        blocks = []
+        for text_var in self.text_vars:
+
+            # clean text
+            if fit:
+                text, tokens = _clean_text(df_new[text_var], tokens = True)
+            else:
+                text = _clean_text(df_new[text_var])
+            df_new[text_var] = text
+
+            # word and character count
+            counts = _text_counts(text, text_var)
+            if self.text_stats:
+                counts = pd.concat([counts, _text_stats(df[text_var], text, text_var, self.n_jobs)], axis = 1)
+
+            # compute TF-IDF
+            if fit:
+                self.vectorizers[text_var], vals = self._fit_vectorizer(text, tokens)
+            else:
+                vals = self.vectorizers[text_var].transform(text)
+            vals = pd.DataFrame.sparse.from_spmatrix(vals, index = df_new.index)
+            vals.columns = [text_var + '_tfidf_' + str(p) for p in vals.columns]
+            blocks += [counts, vals]
+
+            # compute character TF-IDF
+            if self.char_tf_idf_feats > 0:
+                if fit:
+                    self.char_vectorizers[text_var] = self._char_vectorizer()
+                    vals = self.char_vectorizers[text_var].fit_transform(text)
+                else:
+                    vals = self.char_vectorizers[text_var].transform(text)
+                vals = pd.DataFrame.sparse.from_spmatrix(vals, index = df_new.index)
+                vals.columns = [text_var + '_char_tfidf_' + str(p) for p in vals.columns]
+                blocks.append(vals)
+
+        # remove original features
         if drop:
-            df_new.drop(text_var, axis = 1, inplace = True)
-        
-    # return results
-    print('Added {} text-based features.'.format(df_new.shape[1] - n_feats + int(drop) * len(text_vars)))
-    return df_new
+            df_new.drop(self.text_vars, axis = 1, inplace = True)
+        return pd.concat([df_new] + blocks, axis = 1)
+
+
+def _clean_text(text, tokens = False):
+    '''
+    Replaces NA with empty strings, converts text to lowercase with single 
+    spaces between words and removes punctuation. Documents are joined into 
+    a single string with a separator, so that each cleaning step is a single 
+    pass over the whole column. Punctuation is removed from the array of code 
+    points with a lookup table. Optionally returns the list of tokens of the 
+    cleaned text as well.
+    '''
+
+    # join documents
+    docs = text.fillna('').tolist()
+    big  = _TEXT_SEP.join(docs)
+
+    # clean text
+    if big.count(_TEXT_SEP) == max(len(docs) - 1, 0):
+        big    = ' '.join(big.lower().split())
+        big    = big.replace(' ' + _TEXT_SEP, _TEXT_SEP).replace(_TEXT_SEP + ' ', _TEXT_SEP)
+        points = np.frombuffer(big.encode('utf-32-le'), dtype = np.uint32)
+        points = points[((_char_flags(points) & 4) == 0) | (points == ord(_TEXT_SEP))]
+        big    = points.tobytes().decode('utf-32-le')
+        docs   = big.split(_TEXT_SEP) if len(docs) > 0 else []
+
+    # clean documents containing the separator
+    else:
+        docs = [_PUNCTUATION_RE.sub('', ' '.join(doc.lower().split())) for doc in docs]
+        big  = ' '.join(docs)
+
+    cleaned = pd.Series(docs, index = text.index, name = text.name, dtype = object)
+    if tokens:
+        return cleaned, big.replace(_TEXT_SEP, ' ').split()
+    return cleaned
+
+
+_TEXT_SEP       = '\x00'
+_PUNCTUATION_RE = re.compile(r'[^\w\s]')
+
+
+def _text_counts(text, text_var):
+    '''
+    Computes word and character counts of cleaned text.
+    '''
+    docs = text.tolist()
+    return pd.DataFrame({text_var + '_word_count': np.fromiter((doc.count(' ') + 1 if doc else 0 for doc in docs), 
+                                                               dtype = np.int64, count = len(docs)), 
+                         text_var + '_char_count': np.fromiter(map(len, docs), dtype = np.int64, count = len(docs))}, 
+                        index = text.index)
+
+
+def _word_frequencies(tokens):
+    '''
+    Counts the words that TF-IDF features are built from. Words are sorted by 
+    decreasing frequency and ties alphabetically.
+    '''
+    words, counts = np.unique(np.array(tokens, dtype = object), return_counts = True)
+    is_word = np.array([(len(word) > 1) and (word not in ENGLISH_STOP_WORDS) for word in words], dtype = bool)
+    words, counts = words[is_word], counts[is_word]
+    order = np.argsort(-counts, kind = 'mergesort')
+    return pd.Series(counts[order], index = words[order])
+
+
+_TEXT_STATS = ['unique_word_ratio', 'avg_word_length', 'upper_ratio', 'digit_ratio', 'punct_ratio']
+
+def _text_stats(raw, text, text_var, n_jobs = 1):
+    '''
+    Computes word statistics of cleaned text and character statistics of raw 
+    text. With n_jobs > 1, chunks of documents are processed in a process 
+    pool.
+    '''
+    index     = text.index
+    raw, text = raw.fillna('').tolist(), text.tolist()
+    if n_jobs > 1:
+        size   = -(-len(text) // n_jobs)
+        chunks = ((raw[i:(i + size)], text[i:(i + size)]) for i in range(0, len(text), size))
+        stats  = list(_map_chunks(_text_stats_chunk, chunks, (), n_jobs))
+        stats  = np.concatenate(stats, axis = 0) if len(stats) > 0 else np.zeros((0, len(_TEXT_STATS)))
+    else:
+        stats = _text_stats_chunk((raw, text))
+    return pd.DataFrame(stats, index = index, columns = [text_var + '_' + stat for stat in _TEXT_STATS])
+
+
+def _text_stats_chunk(docs):
+    '''
+    Computes text statistics of lists of raw and cleaned documents in a 
+    single scan over their code points. Characters are classified with 
+    lookup tables and summed per document with np.add.reduceat(). Returns 
+    an array with one row per document and one column per statistic.
+    '''
+    raw, text = docs
+    stats = np.zeros((len(text), len(_TEXT_STATS)))
+
+    # character classes of raw text
+    points, starts, lens = _code_points(raw)
+    flags  = _char_flags(points)
+    n_char = np.maximum(lens, 1)
+    for k, flag in enumerate([1, 2, 4]):
+        stats[:, 2 + k] = _segment_sums((flags & flag) > 0, starts, lens) / n_char
+
+    # words of cleaned text
+    points, starts, lens = _code_points(text)
+    is_char  = points != ord(' ')
+    is_first = is_char & np.concatenate([[True], ~is_char[:-1]])
+    is_first[starts[lens > 0]] = is_char[starts[lens > 0]]
+    n_words  = _segment_sums(is_first, starts, lens)
+    n_unique = np.zeros(len(text), dtype = np.int64)
+    if n_words.sum() > 0:
+        codes   = pd.factorize(np.array(' '.join(text).split(), dtype = object))[0]
+        doc_ids = np.repeat(np.arange(len(text)), n_words)
+        pairs   = np.unique(doc_ids * (codes.max() + 1) + codes)
+        n_unique = np.bincount(pairs // (codes.max() + 1), minlength = len(text))
+    stats[:, 0] = n_unique / np.maximum(n_words, 1)
+    stats[:, 1] = _segment_sums(is_char, starts, lens) / np.maximum(n_words, 1)
+    return stats
+
+
+def _code_points(docs):
+    '''
+    Converts a list of documents into an array of code points with start 
+    positions and lengths of the documents.
+    '''
+    lens   = np.fromiter(map(len, docs), dtype = np.int64, count = len(docs))
+    points = np.frombuffer(''.join(docs).encode('utf-32-le'), dtype = np.uint32)
+    starts = np.concatenate([[0], np.cumsum(lens)[:-1]]).astype(np.int64) if len(docs) > 0 else lens
+    return points, starts, lens
+
+
+def _segment_sums(values, starts, lens):
+    '''
+    Sums values over segments given by start positions and lengths. Empty 
+    segments get zero.
+    '''
+    sums = np.zeros(len(lens), dtype = np.int64)
+    if len(values) > 0:
+        is_full = lens > 0
+        sums[is_full] = np.add.reduceat(values.astype(np.int64), starts[is_full])
+    return sums
+
+
+def _char_flags(points):
+    '''
+    Classifies code points as uppercase (1), digit (2) and punctuation (4) 
+    characters. Flags of the Basic Multilingual Plane are precomputed in a 
+    lookup table; other code points are classified one unique value at a 
+    time.
+    '''
+    global _CHAR_FLAGS
+    if _CHAR_FLAGS is None:
+        _CHAR_FLAGS = np.array([_classify_char(chr(c)) for c in range(65536)], dtype = np.uint8)
+    is_bmp = points < 65536
+    flags  = np.zeros(len(points), dtype = np.uint8)
+    flags[is_bmp] = _CHAR_FLAGS[points[is_bmp]]
+    if not is_bmp.all():
+        other, inverse = np.unique(points[~is_bmp], return_inverse = True)
+        flags[~is_bmp] = np.array([_classify_char(chr(c)) for c in other], dtype = np.uint8)[inverse]
+    return flags
+
+
+def _classify_char(c):
+    '''
+    Returns the uppercase, digit and punctuation flags of a character.
+    '''
+    return int(c.isupper()) | (2 * int(c.isdigit())) | (4 * int(_PUNCTUATION_RE.match(c) is not None))
+
+
+_CHAR_FLAGS = None
+
+
+
+def add_text_hash_features(df, 
+                           text_vars, 
+                           n_features  = 2 ** 20, 
+                           ngram_range = (1, 1), 
+                           chunksize   = 100000, 
+                           n_jobs      = 1, 
+                           output_path = None, 
+                           drop        = True):
+    '''
+    Adds word count and character count features to the data frame and 
+    computes hashed term frequencies of textual features as a sparse matrix. 
+    The hashing trick uses a fixed number of features without storing a 
+    vocabulary, so documents are processed in chunks with bounded memory. 
+    Chunks can be processed in parallel worker processes with n_jobs > 1.
+
+    --------------------
+    Arguments:
+    - df (pandas DF): dataset
+    - text_vars (list): list of textual features
+    - n_features (int): number of hashed features per textual feature
+    - ngram_range (int, int): range of n-grams for hashed features
+    - chunksize (int): number of documents processed at a time
+    - n_jobs (int): number of worker processes hashing chunks
+    - output_path (str): directory for writing the sparse matrix in chunks
+    - drop (bool): whether to drop the original textual features
+
+    --------------------
+    Returns:
+    - pandas DF with count features
+    - scipy.sparse CSR matrix with L2-normalized hashed features or, if 
+      output_path is given, list of paths to .npz files with chunks of rows
+
+    --------------------
+    Examples:
+
+    # import dependencies
+    import pandas as pd
+    import scipy.sparse
+
+    # create data frame
+    df = pd.DataFrame({'review': ['Great product!', 'Bad quality, would not buy', 'great value']})
+
+    # add text features
+    from dptools import add_text_hash_features
+    df_new, X = add_text_hash_features(df, text_vars = 'review', n_features = 2 ** 18)
+
+    # write hashed features in chunks
+    df_new, files = add_text_hash_features(df, text_vars = 'review', chunksize = 2, output_path = 'hashed')
+    X = scipy.sparse.vstack([scipy.sparse.load_npz(f) for f in files], format = 'csr')
+    '''
+
+    # convert to list
+    if not isinstance(text_vars, list):
+        text_vars = [text_vars]
+    if output_path is not None:
+        os.makedirs(output_path, exist_ok = True)
+
+    # hash chunks
+    chunks = (df[text_vars].iloc[i:(i + chunksize)] for i in range(0, df.shape[0], chunksize))
+    args   = (n_features, ngram_range)
+    counts, matrices = [], []
+    for k, (chunk_counts, X) in enumerate(_map_chunks(_hash_text_chunk, chunks, args, n_jobs)):
+        counts.append(chunk_counts)
+        if output_path is not None:
+            X_path = os.path.join(output_path, 'part_{:05d}.npz'.format(k))
+            scipy.sparse.save_npz(X_path, X)
+            X = X_path
+        matrices.append(X)
+
+    # merge chunks
+    if output_path is None:
+        if len(matrices) > 0:
+            matrices = scipy.sparse.vstack(matrices, format = 'csr')
+        else:
+            matrices = scipy.sparse.csr_matrix((0, n_features * len(text_vars)))
+    counts = pd.concat(counts, axis = 0) if len(counts) > 0 else pd.DataFrame(columns = _text_count_names(text_vars))
+    counts.index = df.index
+
+    # add count features
+    df_new = df.drop(text_vars, axis = 1) if drop else df.copy()
+    df_new = pd.concat([df_new, counts], axis = 1)
+    print('Added {} text-based features and {} hashed features.'.format(counts.shape[1], n_features * len(text_vars)))
+    return df_new, matrices
+
+
+def _text_count_names(text_vars):
+    '''
+    Returns the names of word count and character count features.
+    '''
+    return [text_var + suffix for text_var in text_vars for suffix in ['_word_count', '_char_count']]
+
+
+def _hash_text_chunk(df, n_features, ngram_range):
+    '''
+    Computes count features and hashed term frequencies of a chunk of 
+    textual features.
+    '''
+    vectorizer = HashingVectorizer(n_features     = n_features, 
+                                   lowercase      = True, 
+                                   norm           = 'l2', 
+                                   alternate_sign = False, 
+                                   analyzer       = 'word', 
+                                   stop_words     = 'english', 
+                                   ngram_range    = ngram_range)
+    counts, matrices = [], []
+    for text_var in df.columns:
+        text = _clean_text(df[text_var])
+        counts.append(_text_counts(text, text_var))
+        matrices.append(vectorizer.transform(text))
+    return pd.concat(counts, axis = 1), scipy.sparse.hstack(matrices, format = 'csr')
+
+
+def _map_chunks(func, chunks, args, n_jobs):
+    '''
+    Applies a function to chunks in order. With n_jobs > 1, chunks are 
+    processed in a process pool that keeps at most 2 * n_jobs chunks in 
+    flight to bound memory.
+    '''
+    if n_jobs <= 1:
+        for chunk in chunks:
+            yield func(chunk, *args)
+        return
+    with ProcessPoolExecutor(max_workers = n_jobs) as executor:
+        futures = collections.deque()
+        for chunk in chunks:
+            futures.append(executor.submit(func, chunk, *args))
+            if len(futures) >= 2 * n_jobs:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
 
 
 
@@ -208,6 +1032,11 @@ def add_text_features(df,
 #                             
 ###############################
 
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import pickle
+import uuid
+import numpy as np
 import pandas as pd
 
 def aggregate_data(df, 
@@ -216,22 +1045,33 @@ def aggregate_data(df,
                    fac_stats = ['count', 'mode'],
                    factors   = None, 
                    var_label = None, 
-                   sd_zeros  = False):
+                   sd_zeros  = False, 
+                   n_jobs    = 1):
     '''
     Aggregates the data by a certain categorical feature. Continuous features 
     are aggregated by computing summary statistics by the grouping feature. 
     Categorical features are aggregated by computing the most frequent values
     and number of unique value by the grouping feature.
 
+    With n_jobs > 1, the data is split into hash partitions of the grouping 
+    feature, which are aggregated in parallel worker processes.
+
+    The data can also be passed as an iterator over pandas DF chunks, e.g. 
+    from pd.read_csv(chunksize = ...). Chunks are reduced to mergeable partial 
+    aggregates per group, so the full data never has to fit in memory. 
+    Chunked aggregation supports the 'count', 'sum', 'mean', 'std', 'var', 
+    'min' and 'max' numeric stats.
+
     --------------------
     Arguments:
-    - df (pandas DF): dataset
+    - df (pandas DF): dataset or iterator over pandas DF chunks
     - group_var (str): grouping feature
     - num_stats (list): list of stats for aggregating numeric features
     - fac_stats (list): list of stats for aggregating categorical features
     - factors (list): list of categorical features names
     - var_label (str): prefix for feature names after aggregation
     - sd_zeros (bool): whether to replace NA with 0 for standard deviation
+    - n_jobs (int): number of worker processes aggregating hash partitions of the groups
 
     --------------------
     Returns
@@ -255,7 +1095,21 @@ def aggregate_data(df,
     from dptools import aggregate_data
     df_new = aggregate_data(df, group_var = 'gender', num_stats = ['min', 'max'], fac_stats = 'mode')   
 
+    # aggregate a large file in chunks
+    chunks = pd.read_csv('transactions.csv', chunksize = 1000000)
+    df_new = aggregate_data(chunks, group_var = 'customer_id', num_stats = ['mean', 'std'])
     '''
+
+    ##### CHUNKED DATA
+
+    # aggregate chunks
+    if not isinstance(df, pd.DataFrame):
+        print('- Aggregating data chunks...')
+        state = AggregationState(group_var, num_stats, fac_stats, factors)
+        for chunk in df:
+            state.update(chunk)
+        return state.result(var_label, sd_zeros)
+
     
     ##### SEPARATE FEATURES
 
@@ -264,8 +1118,8 @@ def aggregate_data(df,
 
     # find factors
     if factors == None:
-        df_factors = [f for f in df.columns if df[f].dtype == 'object']
-        factors    = [f for f in df_factors if f != group_var]
+        factors    = [f for f in df.columns if (df[f].dtype == 'object') and (f != group_var)]
+        df_factors = factors + [group_var]
     else:
         if not isinstance(factors, list):
             factors = [factors]
@@ -288,27 +1142,57 @@ def aggregate_data(df,
 
     ##### AGGREGATION
 
-    # aggregate numerics
+    # display info
     if n_nums > 0:
         print('- Aggregating numeric features...')
-        num_df = num_df.groupby([group_var]).agg(num_stats)
-        num_df.columns = ['_'.join(col).strip() for col in num_df.columns.values]
-        num_df = num_df.sort_index()
-
-    # aggregate factors
     if n_facs > 0:
         print('- Aggregating factor features...')
-        if (fac_stats == ['count', 'mode']) or (fac_stats == ['mode', 'count']):
-            fac_df = fac_df.groupby([group_var]).agg([('count'), ('mode', lambda x: pd.Series.mode(x)[0])])
-        if (fac_stats == 'count') or (fac_stats == ['count']):
-            fac_df = fac_df.groupby([group_var]).agg([('count')])
-        if (fac_stats == 'mode') or (fac_stats == ['mode']):
-            fac_df = fac_df.groupby([group_var]).agg([('mode', lambda x: pd.Series.mode(x)[0])])
-        fac_df.columns = ['_'.join(col).strip() for col in fac_df.columns.values]
-        fac_df = fac_df.sort_index()           
 
+    # aggregate features
+    if n_jobs > 1:
+        agg_df = _aggregate_partitions(num_df, fac_df, group_var, num_stats, fac_stats, n_jobs)
+    else:
+        agg_df = _aggregate_frame(num_df, fac_df, group_var, num_stats, fac_stats)
+
+
+    ##### LAST STEPS
+
+    return _finalize_aggregation(agg_df, var_label, sd_zeros)
 
-    ##### MERGER
+
+def _aggregate_frame(num_df, fac_df, group_var, num_stats, fac_stats):
+    '''
+    Aggregates numeric and factor features by the grouping feature.
+    '''
+
+    # count features
+    n_facs = fac_df.shape[1] - 1
+    n_nums = num_df.shape[1] - 1
+
+    # aggregate numerics
+    if n_nums > 0:
+        if not isinstance(num_stats, list):
+            num_stats = [num_stats]
+        if _is_fusable(num_df, group_var, num_stats):
+            num_df = _fused_num_stats(num_df, group_var, num_stats)
+        else:
+            num_df = num_df.groupby([group_var]).agg(num_stats)
+            num_df.columns = ['_'.join(col).strip() for col in num_df.columns.values]
+            num_df = num_df.sort_index()
+
+    # aggregate factors
+    if n_facs > 0:
+        if not isinstance(fac_stats, list):
+            fac_stats = [fac_stats]
+        group_codes, groups = pd.factorize(fac_df[group_var], sort = True)
+        fac_aggs = {}
+        for var in [f for f in fac_df.columns if f != group_var]:
+            if 'count' in fac_stats:
+                is_valid = (group_codes >= 0) & fac_df[var].notnull().values
+                fac_aggs[var + '_count'] = np.bincount(group_codes[is_valid], minlength = len(groups))
+            if 'mode' in fac_stats:
+                fac_aggs[var + '_mode'] = _group_mode(group_codes, len(groups), fac_df[var])
+        fac_df = pd.DataFrame(fac_aggs, index = pd.Index(groups, name = group_var))
 
     # merge numerics and factors
     if ((n_facs > 0) & (n_nums > 0)):
@@ -321,9 +1205,145 @@ def aggregate_data(df,
     # use numerics only
     if ((n_facs == 0) & (n_nums > 0)):
         agg_df = num_df
-        
 
-    ##### LAST STEPS
+    return agg_df
+
+
+def _is_fusable(num_df, group_var, num_stats):
+    '''
+    Checks whether the numeric stats can be computed by _fused_num_stats().
+    '''
+    fused_stats = ['count', 'sum', 'mean', 'std', 'var', 'min', 'max', 'first', 'last']
+    numerics    = [f for f in num_df.columns if f != group_var]
+    return (isinstance(group_var, str) and all(stat in fused_stats for stat in num_stats) and 
+            all(num_df[f].dtype in [np.int64, np.float64] for f in numerics))
+
+
+def _fused_num_stats(num_df, group_var, num_stats):
+    '''
+    Computes count, sum, mean, std, var, min, max, first and last of all 
+    numeric features with segment reductions over a float64 block that holds 
+    one contiguous row per feature with values sorted by group. Returns the 
+    same output as groupby().agg(num_stats).
+    '''
+
+    # sort values by group
+    numerics      = [f for f in num_df.columns if f != group_var]
+    codes, groups = pd.factorize(num_df[group_var], sort = True)
+    rows          = np.flatnonzero(codes >= 0)
+    rows          = rows[np.argsort(codes[rows], kind = 'mergesort')]
+    codes         = codes[rows]
+    starts        = np.searchsorted(codes, np.arange(len(groups)))
+    block         = np.empty((len(numerics), len(rows)))
+    for j, var in enumerate(numerics):
+        block[j] = num_df[var].to_numpy(dtype = np.float64)[rows]
+    is_valid      = ~np.isnan(block)
+    has_missings  = not is_valid.all()
+
+    # segment reductions
+    stats = {}
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        if has_missings:
+            counts = np.add.reduceat(is_valid, starts, axis = 1, dtype = np.int64)
+            sums   = np.add.reduceat(np.where(is_valid, block, 0), starts, axis = 1)
+        else:
+            counts = np.tile(np.diff(np.append(starts, len(rows))), (block.shape[0], 1))
+            sums   = np.add.reduceat(block, starts, axis = 1)
+        means = sums / counts
+        stats['count'] = counts
+        stats['sum']   = sums
+        stats['mean']  = means
+        if ('std' in num_stats) or ('var' in num_stats):
+            squares = block - means[:, codes]
+            if has_missings:
+                squares[~is_valid] = 0
+            np.square(squares, out = squares)
+            variance = np.add.reduceat(squares, starts, axis = 1) / (counts - 1)
+            variance[counts < 2] = np.nan
+            stats['var'] = variance
+            stats['std'] = np.sqrt(variance)
+    if 'min' in num_stats:
+        stats['min'] = np.fmin.reduceat(block, starts, axis = 1)
+    if 'max' in num_stats:
+        stats['max'] = np.fmax.reduceat(block, starts, axis = 1)
+
+    # first and last valid values
+    if ('first' in num_stats) or ('last' in num_stats):
+        padded    = np.hstack([block, np.full((block.shape[0], 1), np.nan)])
+        positions = np.arange(block.shape[1])
+    if 'first' in num_stats:
+        first = np.minimum.reduceat(np.where(is_valid, positions, block.shape[1]), starts, axis = 1)
+        stats['first'] = np.take_along_axis(padded, first, axis = 1)
+    if 'last' in num_stats:
+        last = np.maximum.reduceat(np.where(is_valid, positions, -1), starts, axis = 1)
+        stats['last'] = np.take_along_axis(padded, np.where(last < 0, block.shape[1], last), axis = 1)
+
+    # keep integer dtypes as pandas does
+    is_int = [num_df[f].dtype == np.int64 for f in numerics]
+    if any(is_int) and ('sum' in num_stats):
+        int_vars = [f for f, i in zip(numerics, is_int) if i]
+        int_sums = np.add.reduceat(num_df[int_vars].to_numpy(dtype = np.int64).T[:, rows], starts, axis = 1)
+        int_sums = dict(zip(int_vars, int_sums))
+    aggs = {}
+    for j, var in enumerate(numerics):
+        for stat in num_stats:
+            values = stats[stat][j]
+            if is_int[j] and (stat == 'sum'):
+                values = int_sums[var]
+            elif is_int[j] and (stat in ['min', 'max', 'first', 'last']):
+                values = values.astype(np.int64)
+            aggs[var + '_' + stat] = values
+    return pd.DataFrame(aggs, index = pd.Index(groups, name = group_var))
+
+
+def _aggregate_partitions(num_df, fac_df, group_var, num_stats, fac_stats, n_jobs):
+    '''
+    Aggregates features in hash partitions of the grouping feature using a 
+    process pool. With the fork start method, workers read the data from the 
+    memory inherited from the parent process instead of receiving pickled 
+    copies; only partition numbers and aggregated results are exchanged.
+    '''
+
+    # assign partitions
+    partitions = pd.util.hash_pandas_object(num_df[group_var], index = False).values % np.uint64(n_jobs)
+    partitions = [np.flatnonzero(partitions == k) for k in range(n_jobs)]
+    partitions = [rows for rows in partitions if len(rows) > 0]
+    args       = (group_var, num_stats, fac_stats)
+
+    # aggregate partitions
+    if 'fork' in multiprocessing.get_all_start_methods():
+        token = uuid.uuid4().hex
+        _partition_data[token] = (num_df, fac_df, partitions, args)
+        try:
+            with ProcessPoolExecutor(max_workers = n_jobs, mp_context = multiprocessing.get_context('fork')) as executor:
+                aggs = list(executor.map(_aggregate_shared_partition, [token] * len(partitions), range(len(partitions))))
+        finally:
+            del _partition_data[token]
+    else:
+        with ProcessPoolExecutor(max_workers = n_jobs) as executor:
+            aggs = list(executor.map(_aggregate_frame, 
+                                     [num_df.iloc[rows] for rows in partitions], 
+                                     [fac_df.iloc[rows] for rows in partitions], 
+                                     *[[arg] * len(partitions) for arg in args]))
+
+    # merge partitions
+    return pd.concat(aggs, axis = 0).reindex(columns = aggs[0].columns).sort_index()
+
+
+_partition_data = {}
+
+def _aggregate_shared_partition(token, k):
+    '''
+    Aggregates a partition of the data inherited from the parent process.
+    '''
+    num_df, fac_df, partitions, args = _partition_data[token]
+    return _aggregate_frame(num_df.iloc[partitions[k]], fac_df.iloc[partitions[k]], *args)
+
+
+def _finalize_aggregation(agg_df, var_label = None, sd_zeros = False):
+    '''
+    Adds the label to aggregated features and imputes standard deviations.
+    '''
 
     # update labels
     if (var_label != None):
@@ -341,6 +1361,455 @@ def aggregate_data(df,
     return agg_df
 
 
+class AggregationState:
+    '''
+    Keeps mergeable partial aggregates per group: counts, sums, sums of 
+    squared deviations, minima and maxima of numeric features and counts of 
+    factor levels. New rows are merged into the state with update(), which 
+    only touches the groups present in the new rows, so refreshing the 
+    aggregates depends on the size of the new data rather than the history. 
+    The state can be saved to disk and loaded for the next refresh. Integer 
+    stats are only kept as integers while all rows have integer dtype, so new 
+    rows with non-integer values are never truncated.
+
+    Supports the 'count', 'sum', 'mean', 'std', 'var', 'min' and 'max' 
+    numeric stats and the 'count' and 'mode' factor stats.
+
+    --------------------
+    Arguments:
+    - group_var (str): grouping feature
+    - num_stats (list): list of stats for aggregating numeric features
+    - fac_stats (list): list of stats for aggregating categorical features
+    - factors (list): list of categorical features names
+
+    --------------------
+    Examples:
+
+    # aggregate the history
+    from dptools import AggregationState
+    state = AggregationState(group_var = 'customer_id', num_stats = ['mean', 'std'])
+    state.update(df_history)
+    state.save('state.pkl')
+
+    # refresh the aggregates with new rows
+    state = AggregationState.load('state.pkl')
+    state.update(df_new_rows)
+    df_agg = state.result()
+    '''
+
+    num_stats_supported = ['count', 'sum', 'mean', 'std', 'var', 'min', 'max']
+
+    def __init__(self, 
+                 group_var, 
+                 num_stats = ['mean', 'sum'], 
+                 fac_stats = ['count', 'mode'], 
+                 factors   = None):
+        if not isinstance(num_stats, list):
+            num_stats = [num_stats]
+        if not isinstance(fac_stats, list):
+            fac_stats = [fac_stats]
+        if any(stat not in self.num_stats_supported for stat in num_stats):
+            raise ValueError('num_stats must be a subset of {}'.format(self.num_stats_supported))
+        if (factors is not None) and not isinstance(factors, list):
+            factors = [factors]
+        self.group_var = group_var
+        self.num_stats = num_stats
+        self.fac_stats = fac_stats
+        self.factors   = factors
+        self.numerics  = None
+        self.int_vars  = None
+        self.nums      = None
+        self.levels    = None
+
+    def update(self, df):
+        '''
+        Merges partial aggregates of new rows into the state.
+
+        --------------------
+        Arguments:
+        - df (pandas DF): new rows
+
+        --------------------
+        Returns:
+        - updated state
+        '''
+
+        # find features
+        if self.numerics is None:
+            if self.factors is None:
+                self.factors = [f for f in df.columns if (df[f].dtype == 'object') and (f != self.group_var)]
+            self.numerics = [f for f in df.columns if f not in self.factors + [self.group_var]]
+            self.int_vars = [f for f in self.numerics if pd.api.types.is_integer_dtype(df[f])]
+        if df.shape[0] == 0:
+            return self
+
+        # check dtypes of new rows
+        self.int_vars = [f for f in self.int_vars if pd.api.types.is_integer_dtype(df[f])]
+        for var in [f for f in self.numerics if df[f].dtype == 'object']:
+            self._to_factor(var)
+
+        # aggregate numerics
+        if len(self.numerics) > 0:
+            grouped = df.groupby(self.group_var)[self.numerics]
+            counts  = grouped.count()
+            nums    = {'count': counts, 
+                       'sum':   grouped.sum().astype(float), 
+                       'm2':    (grouped.var(ddof = 0) * counts).fillna(0), 
+                       'min':   grouped.min().astype(float), 
+                       'max':   grouped.max().astype(float)}
+            if self.nums is None:
+                self.nums = nums
+            else:
+                self.nums = self._merge_groups(self.nums, nums, _merge_moments)
+
+        # count factor levels
+        if len(self.factors) > 0:
+            levels = {var: df.groupby([self.group_var, var]).size() for var in self.factors}
+            if self.levels is None:
+                self.levels = levels
+            else:
+                self.levels = {var: self._merge_groups(self.levels[var], levels[var], lambda a, b: a + b) 
+                                    if var in self.levels else levels[var] for var in self.factors}
+        return self
+
+    def _to_factor(self, var):
+        '''
+        Moves a numeric feature with non-numeric values in new rows to the 
+        factors. This happens when pd.read_csv(chunksize = ...) reads a text 
+        column as float in chunks where it only has missing values. Features 
+        with numeric values in earlier rows cannot be moved.
+        '''
+        if (self.nums is not None) and (self.nums['count'][var].sum() > 0):
+            raise ValueError('feature \'{}\' has numeric values in earlier rows and non-numeric values in new rows; '
+                             'pass it in factors or set its dtype when reading the data'.format(var))
+        self.numerics = [f for f in self.numerics if f != var]
+        self.factors  = self.factors + [var]
+        if self.nums is not None:
+            self.nums = {stat: self.nums[stat].drop(columns = var) for stat in self.nums}
+
+    def result(self, var_label = None, sd_zeros = False):
+        '''
+        Computes aggregated features from the partial aggregates.
+
+        --------------------
+        Arguments:
+        - var_label (str): prefix for feature names after aggregation
+        - sd_zeros (bool): whether to replace NA with 0 for standard deviation
+
+        --------------------
+        Returns:
+        - aggregated pandas DF
+        '''
+        aggs = []
+
+        # numeric stats
+        if self.nums is not None:
+            counts   = self.nums['count']
+            variance = self.nums['m2'] / (counts - 1).where(counts > 1)
+            stats    = {'count': counts, 
+                        'sum':   self.nums['sum'], 
+                        'mean':  self.nums['sum'] / counts.where(counts > 0), 
+                        'var':   variance, 
+                        'std':   np.sqrt(variance), 
+                        'min':   self.nums['min'], 
+                        'max':   self.nums['max']}
+            num_df = pd.DataFrame({var + '_' + stat: _restore_int(stats[stat][var], stat, var in self.int_vars) 
+                                   for var in self.numerics for stat in self.num_stats})
+            aggs.append(num_df)
+
+        # factor stats
+        if self.levels is not None:
+            fac_aggs = {}
+            for var in self.factors:
+                levels = self.levels[var]
+                if 'count' in self.fac_stats:
+                    fac_aggs[var + '_count'] = levels.groupby(level = 0).sum()
+                if 'mode' in self.fac_stats:
+                    modes = levels.rename('n').reset_index()
+                    modes = modes.sort_values(['n', var], ascending = [False, True], kind = 'mergesort')
+                    modes = modes.drop_duplicates(self.group_var).set_index(self.group_var)[var]
+                    fac_aggs[var + '_mode'] = modes
+            aggs.append(pd.DataFrame(fac_aggs))
+
+        # merge numerics and factors
+        agg_df = pd.concat(aggs, axis = 1).sort_index()
+        agg_df.index.name = self.group_var
+
+        # count groups without factor levels
+        if (self.levels is not None) and ('count' in self.fac_stats):
+            for var in self.factors:
+                agg_df[var + '_count'] = agg_df[var + '_count'].fillna(0).astype(np.int64)
+        return _finalize_aggregation(agg_df, var_label, sd_zeros)
+
+    def save(self, file_path):
+        '''
+        Saves the state as a pickle file.
+
+        --------------------
+        Arguments:
+        - file_path (str): file path including the file name
+        '''
+        with open(file_path, 'wb') as f:
+            pickle.dump(self.__dict__, f, protocol = pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, file_path):
+        '''
+        Loads a state saved with save().
+
+        --------------------
+        Arguments:
+        - file_path (str): file path including the file name
+
+        --------------------
+        Returns:
+        - aggregation state
+        '''
+        with open(file_path, 'rb') as f:
+            state = pickle.load(f)
+        agg_state = cls(group_var = state['group_var'])
+        agg_state.__dict__.update(state)
+        return agg_state
+
+    @staticmethod
+    def _merge_groups(old, new, merge):
+        '''
+        Merges partial aggregates of new rows into the state. Groups already 
+        in the state are looked up and merged in place, unseen groups are 
+        appended, so the work scales with the number of new groups.
+        '''
+        is_dict = isinstance(old, dict)
+        index   = (new['count'] if is_dict else new).index
+        pos     = (old['count'] if is_dict else old).index.get_indexer(index)
+        seen    = pos >= 0
+
+        # merge seen groups
+        if seen.any():
+            if is_dict:
+                merged = merge({stat: old[stat].iloc[pos[seen]].set_axis(index[seen]) for stat in old}, 
+                               {stat: new[stat][seen] for stat in new})
+                for stat in old:
+                    old[stat].iloc[pos[seen]] = merged[stat].values
+            else:
+                old.iloc[pos[seen]] = merge(old.values[pos[seen]], new.values[seen])
+
+        # append unseen groups
+        if not seen.all():
+            if is_dict:
+                old = {stat: pd.concat([old[stat], new[stat][~seen]]) for stat in old}
+            else:
+                old = pd.concat([old, new[~seen]])
+        return old
+
+
+def _merge_moments(a, b):
+    '''
+    Merges partial counts, sums, sums of squared deviations, minima and maxima 
+    of two sets of groups.
+    '''
+    a = {stat: a[stat].reindex(a['count'].index.union(b['count'].index)) for stat in a}
+    b = {stat: b[stat].reindex(a['count'].index) for stat in b}
+    n_a, n_b = a['count'].fillna(0), b['count'].fillna(0)
+    n = n_a + n_b
+    delta = (b['sum'] / n_b.where(n_b > 0) - a['sum'] / n_a.where(n_a > 0)).fillna(0)
+    return {'count': n.astype(np.int64), 
+            'sum':   a['sum'].fillna(0) + b['sum'].fillna(0), 
+            'm2':    a['m2'].fillna(0) + b['m2'].fillna(0) + (delta ** 2 * n_a * n_b / n.where(n > 0)).fillna(0), 
+            'min':   np.fmin(a['min'], b['min']), 
+            'max':   np.fmax(a['max'], b['max'])}
+
+
+def _restore_int(values, stat, is_int):
+    '''
+    Casts aggregates of integer features back to integers where pandas keeps 
+    the integer dtype.
+    '''
+    if (stat == 'count') or (is_int and (stat in ['sum', 'min', 'max']) and values.notnull().all()):
+        return values.astype(np.int64)
+    return values
+
+
+def _group_mode(group_codes, n_groups, values):
+    '''
+    Computes the most frequent non-missing value per group with a sort-based 
+    count of (group, value) pairs. Ties are resolved by the smallest value as 
+    in pd.Series.mode(). Groups without values get NA.
+    '''
+
+    # count pairs
+    value_codes, levels = pd.factorize(values, sort = True)
+    is_valid = (group_codes >= 0) & (value_codes >= 0)
+    keys     = group_codes[is_valid].astype(np.int64) * len(levels) + value_codes[is_valid]
+    keys, counts = np.unique(keys, return_counts = True)
+    pair_groups, pair_values = keys // max(len(levels), 1), keys % max(len(levels), 1)
+
+    # pick most frequent value per group
+    order  = np.lexsort((pair_values, -counts, pair_groups))
+    first  = order[np.r_[True, pair_groups[order][1:] != pair_groups[order][:-1]]] if len(order) > 0 else order
+    modes  = np.full(n_groups, -1, dtype = np.int64)
+    modes[pair_groups[first]] = pair_values[first]
+    if (modes < 0).any():
+        return levels.take(modes, allow_fill = True, fill_value = np.nan)
+    return levels.take(modes)
+
+
+
+###############################
+#                             
+#      AGGREGATE WINDOWS       
+#                             
+###############################
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+def aggregate_windows(df, 
+                      group_vars, 
+                      date_var, 
+                      windows   = [7, 30, 90], 
+                      num_stats = ['mean', 'sum'], 
+                      numerics  = None, 
+                      ref_date  = None, 
+                      var_label = None):
+    '''
+    Aggregates numeric features by multiple grouping features over multiple 
+    lookback windows. The data is sorted by date once and every window is a 
+    contiguous range of the sorted rows. Windows are processed from the 
+    shortest to the longest, so that the partial aggregates of each window 
+    are reused by the next one and every row is aggregated once per grouping 
+    feature.
+
+    --------------------
+    Arguments:
+    - df (pandas DF): dataset
+    - group_vars (list): list of grouping features
+    - date_var (str): name of the date feature
+    - windows (list): list of lookback windows in days; None stands for the full history
+    - num_stats (list): list of stats for aggregating numeric features
+      ('count', 'sum', 'mean', 'std', 'var', 'min' or 'max')
+    - numerics (list): list of numeric features; all non-object features are used by default
+    - ref_date (str): end date of the lookback windows; the latest date by default
+    - var_label (str): prefix for feature names after aggregation
+
+    --------------------
+    Returns
+    - dictionary with an aggregated pandas DF for each grouping feature
+
+    --------------------
+    Examples:
+
+    # import dependencies
+    import pandas as pd
+    import numpy as np
+
+    # create data frame
+    data = {'customer': ['a', 'b', 'a', 'a', 'b'], 
+            'shop': ['x', 'x', 'y', 'x', 'y'], 
+            'date': pd.to_datetime(['2020-01-01', '2020-01-20', '2020-02-15', '2020-03-01', '2020-03-02']), 
+            'amount': [10, 25, 5, 12, 30]}
+    df = pd.DataFrame(data)
+
+    # aggregate the data
+    from dptools import aggregate_windows
+    aggs = aggregate_windows(df, group_vars = ['customer', 'shop'], date_var = 'date', 
+                             windows = [7, 30, None], num_stats = ['sum', 'max'])
+    aggs['customer']
+    '''
+
+    # convert to list
+    if not isinstance(group_vars, list):
+        group_vars = [group_vars]
+    if not isinstance(windows, list):
+        windows = [windows]
+    if not isinstance(num_stats, list):
+        num_stats = [num_stats]
+    if numerics is None:
+        numerics = [f for f in df.columns if (df[f].dtype != 'object') and (f not in group_vars + [date_var])]
+    elif not isinstance(numerics, list):
+        numerics = [numerics]
+
+    # sort by date
+    print('- Sorting the dataset...')
+    dates    = pd.to_datetime(df[date_var]).values.astype('datetime64[ns]')
+    ref_date = dates.max() if ref_date is None else np.datetime64(pd.Timestamp(ref_date), 'ns')
+    order    = np.argsort(dates, kind = 'mergesort')
+    order    = order[~np.isnat(dates[order])]
+    order    = order[:np.searchsorted(dates[order], ref_date, side = 'right')]
+    dates    = dates[order]
+    values   = np.ascontiguousarray(df[numerics].to_numpy(dtype = float)[order])
+
+    # find window starts from the shortest to the longest window
+    windows = sorted(windows, key = lambda w: np.inf if w is None else w)
+    starts  = [0 if w is None else np.searchsorted(dates, ref_date - np.timedelta64(w, 'D'), side = 'right') 
+               for w in windows]
+    labels  = ['all' if w is None else '{}d'.format(w) for w in windows]
+
+    # aggregate by each grouping feature
+    aggs = {}
+    for group_var in group_vars:
+        print('- Aggregating by {}...'.format(group_var))
+        codes, groups = pd.factorize(df[group_var].values[order], sort = True)
+        agg_df = _aggregate_window_segments(codes, len(groups), values, starts, num_stats)
+        agg_df.columns = ['{}_{}_{}'.format(numerics[j], stat, labels[k]) for k, stat, j in agg_df.columns]
+        agg_df.index   = pd.Index(groups, name = group_var)
+        aggs[group_var] = _finalize_aggregation(agg_df, var_label)
+    return aggs
+
+
+def _aggregate_window_segments(codes, n_groups, values, starts, num_stats):
+    '''
+    Aggregates rows [starts[k], n) for each window k. Segments between 
+    consecutive starts are aggregated with sparse indicator products and 
+    accumulated, so rows of longer windows reuse the shorter window results.
+    '''
+
+    # initialize accumulators
+    n_vars  = values.shape[1]
+    means   = np.nan_to_num(np.nanmean(values, axis = 0)) if len(values) > 0 else np.zeros(n_vars)
+    counts  = np.zeros((n_groups, n_vars))
+    sums    = np.zeros((n_groups, n_vars))
+    squares = np.zeros((n_groups, n_vars))
+    mins    = np.full((n_groups, n_vars), np.nan)
+    maxs    = np.full((n_groups, n_vars), np.nan)
+
+    # accumulate segments
+    results, end = {}, len(codes)
+    for k, start in enumerate(starts):
+        segment  = slice(start, end)
+        is_valid = ~np.isnan(values[segment])
+        centered = np.where(is_valid, values[segment] - means, 0)
+
+        # skip rows with missing group keys as in groupby
+        has_key  = np.flatnonzero(codes[segment] >= 0)
+        seg_keys = codes[segment][has_key]
+        groups   = scipy.sparse.csr_matrix((np.ones(len(has_key)), (seg_keys, has_key)), 
+                                           shape = (n_groups, end - start))
+        counts  += groups @ is_valid
+        sums    += groups @ np.where(is_valid, values[segment], 0)
+        squares += groups @ (centered ** 2)
+        if 'min' in num_stats:
+            np.fmin.at(mins, seg_keys, values[segment][has_key])
+        if 'max' in num_stats:
+            np.fmax.at(maxs, seg_keys, values[segment][has_key])
+        end = min(end, start)
+
+        # compute stats
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            mean     = sums / counts
+            variance = (squares - (sums - counts * means) ** 2 / counts) / (counts - 1)
+        variance[counts < 2] = np.nan
+        stats = {'count': counts.astype(np.int64), 'sum': sums.copy(), 'mean': mean, 'var': variance, 
+                 'std': np.sqrt(np.maximum(variance, 0)), 'min': mins.copy(), 'max': maxs.copy()}
+        for stat in num_stats:
+            for j in range(n_vars):
+                results[(k, stat, j)] = stats[stat][:, j]
+
+    # order features by window, variable and stat
+    columns = sorted(results, key = lambda col: (col[0], col[2], num_stats.index(col[1])))
+    return pd.DataFrame({col: results[col] for col in columns})
+
+
 
 ###############################
 #                             
@@ -348,17 +1817,41 @@ def aggregate_data(df,
 #                             
 ###############################
 
+import json
+import numpy as np
 import pandas as pd
+import scipy.sparse
 
-def encode_factors(df, factors = None, method = 'label'):
+def encode_factors(df, 
+                   factors      = None, 
+                   method       = 'label', 
+                   sparse       = False, 
+                   max_levels   = None, 
+                   other_label  = 'other', 
+                   n_buckets    = 1024, 
+                   target       = None, 
+                   n_folds      = 5, 
+                   smoothing    = 1, 
+                   random_state = None):
     '''
-    Performs encoding of categorical features using label or dummy encoding.
+    Performs encoding of categorical features using label, dummy, hash, count, 
+    frequency or target encoding. Use FactorEncoder to apply the same encoding 
+    to new data.
 
     --------------------
     Arguments:
     - df (pandas DF): pandas DF
     - factors (str): list of factors; all object features are treated as factors by default
-    - method (str): encoding method ('label' or 'dummy')
+    - method (str): encoding method ('label', 'dummy', 'hash', 'count', 'frequency' or 'target')
+    - sparse (bool): whether to return dummy features as sparse columns
+    - max_levels (int): number of the most frequent levels to keep per factor; 
+      other levels are merged into other_label
+    - other_label (str): name of the level that collects the remaining levels
+    - n_buckets (int): number of hash buckets per factor for hash encoding
+    - target (str): name of the target feature for target encoding
+    - n_folds (int): number of folds for out-of-fold target encoding
+    - smoothing (float): weight of the target mean in smoothed target encoding
+    - random_state (int): random seed for fold assignment in target encoding
 
     --------------------
     Returns:
@@ -380,27 +1873,421 @@ def encode_factors(df, factors = None, method = 'label'):
     # encode factors
     from dptools import encode_factors
     df_enc = encode_factors(df, method = 'label')
+
+    # sparse dummy encoding of the two most frequent levels
+    df_enc = encode_factors(df, method = 'dummy', sparse = True, max_levels = 2)
+
+    # hash encoding into 16 buckets
+    df_enc = encode_factors(df, method = 'hash', n_buckets = 16)
+
+    # out-of-fold target encoding
+    df_enc = encode_factors(df, factors = 'income', method = 'target', target = 'age', n_folds = 2)
     '''
 
-    # copy df
-    df_new = df.copy()
+    # encode data
+    encoder = FactorEncoder(factors      = factors, 
+                            method       = method, 
+                            sparse       = sparse, 
+                            max_levels   = max_levels, 
+                            other_label  = other_label, 
+                            n_buckets    = n_buckets, 
+                            target       = target, 
+                            n_folds      = n_folds, 
+                            smoothing    = smoothing, 
+                            random_state = random_state)
+    return encoder.fit_transform(df)
+
+
+class FactorEncoder:
+    '''
+    Performs encoding of categorical features with mappings learned on training 
+    data. The learned mappings are applied to new data with a vectorized lookup, 
+    so that all batches get the same codes and dummy columns. The encoder can 
+    be saved as a compact JSON file.
+
+    Supported methods:
+    - 'label': integer codes in order of appearance
+    - 'dummy': one binary feature per level
+    - 'hash': binary features in n_buckets hash buckets; always sparse and 
+      does not store any levels
+    - 'count', 'frequency': number or share of training rows with the level
+    - 'target': smoothed mean of the target feature per level; fit_transform() 
+      returns out-of-fold encodings to prevent target leakage
 
-    # list factors
-    if factors is None:
-        factors = [f for f in df_new.columns if df_new[f].dtype == 'object']
+    --------------------
+    Arguments:
+    - factors (str): list of factors; all object features are treated as factors by default
+    - method (str): encoding method ('label', 'dummy', 'hash', 'count', 'frequency' or 'target')
+    - handle_unknown (str): treatment of levels not seen in fit(): 'value' encodes them as 
+      unknown_value in label encoding, as zeros in dummy, count and frequency encoding and 
+      as the target mean in target encoding; 'error' raises an error
+    - unknown_value (int): label code of levels not seen in fit()
+    - sparse (bool): whether to return dummy features as sparse columns
+    - max_levels (int): number of the most frequent levels to keep per factor; 
+      other levels including the ones not seen in fit() are merged into other_label
+    - other_label (str): name of the level that collects the remaining levels; an 
+      existing level with this name is merged into it
+    - n_buckets (int): number of hash buckets per factor for hash encoding
+    - target (str): name of the target feature for target encoding
+    - n_folds (int): number of folds for out-of-fold target encoding
+    - smoothing (float): weight of the target mean in smoothed target encoding
+    - random_state (int): random seed for fold assignment in target encoding
 
-    # convert to list
-    if not isinstance(factors, list):
-        factors = [factors]
-    
-    # label encoding
-    if method == 'label':
+    --------------------
+    Examples:
+
+    # import dependencies
+    import pandas as pd
+    import numpy as np
+
+    # create data frames
+    train = pd.DataFrame({'age': [27, np.nan, 30], 
+                          'gender': ['female', 'male', 'male']})
+    test  = pd.DataFrame({'age': [25, 31], 
+                          'gender': ['male', 'other']})
+
+    # learn and apply encoding
+    from dptools import FactorEncoder
+    encoder   = FactorEncoder(method = 'label')
+    train_enc = encoder.fit_transform(train)
+    test_enc  = encoder.transform(test)
+
+    # save and load encoder
+    encoder.save('encoder.json')
+    encoder = FactorEncoder.load('encoder.json')
+
+    # sparse matrix with dummy features
+    encoder = FactorEncoder(method = 'dummy', max_levels = 100).fit(train)
+    X = encoder.transform_sparse(test)
+    '''
+
+    def __init__(self, 
+                 factors        = None, 
+                 method         = 'label', 
+                 handle_unknown = 'value', 
+                 unknown_value  = -1, 
+                 sparse         = False, 
+                 max_levels     = None, 
+                 other_label    = 'other', 
+                 n_buckets      = 1024, 
+                 target         = None, 
+                 n_folds        = 5, 
+                 smoothing      = 1, 
+                 random_state   = None):
+        methods = ['label', 'dummy', 'hash', 'count', 'frequency', 'target']
+        if method not in methods:
+            raise ValueError('method must be one of {}'.format(methods))
+        if handle_unknown not in ['value', 'error']:
+            raise ValueError('handle_unknown must be \'value\' or \'error\'')
+        if (method == 'target') and (target is None):
+            raise ValueError('target encoding requires a target feature')
+        if (factors is not None) and not isinstance(factors, list):
+            factors = [factors]
+        self.factors        = factors
+        self.method         = method
+        self.handle_unknown = handle_unknown
+        self.unknown_value  = unknown_value
+        self.sparse         = sparse
+        self.max_levels     = max_levels
+        self.other_label    = other_label
+        self.n_buckets      = n_buckets
+        self.target         = target
+        self.n_folds        = n_folds
+        self.smoothing      = smoothing
+        self.random_state   = random_state
+        self.categories     = None
+        self.values         = None
+        self.target_mean    = None
+
+    def fit(self, df):
+        '''
+        Learns the levels of categorical features.
+
+        --------------------
+        Arguments:
+        - df (pandas DF): training data
+
+        --------------------
+        Returns:
+        - fitted encoder
+        '''
+
+        # list factors
+        factors = self.factors
+        if factors is None:
+            factors = [f for f in df.columns if (df[f].dtype == 'object') and (f != self.target)]
+
+        # hash encoding does not store levels
+        self.categories = {}
+        self.values     = {}
+        if self.method == 'hash':
+            self.categories = {var: None for var in factors}
+            return self
+
+        # learn levels in order of appearance; sorted for dummy encoding
         for var in factors:
-            df_new[var], _ = pd.factorize(df_new[var])
-        
-    # dummy encoding
-    if method == 'dummy':
-        df_new = pd.get_dummies(df_new, columns = factors, drop_first = False)
+            categories = pd.factorize(df[var], sort = (self.method == 'dummy'))[1]
+            if (self.max_levels is not None) and (len(categories) > self.max_levels):
+                top_levels = df[var].value_counts().drop(self.other_label, errors = 'ignore').index[:self.max_levels]
+                categories = categories[categories.isin(top_levels)].tolist() + [self.other_label]
+            self.categories[var] = list(categories)
+
+        # learn level values
+        if self.method in ['count', 'frequency', 'target']:
+            if self.method == 'target':
+                y = df[self.target].values.astype(float)
+                self.target_mean = float(np.nanmean(y))
+            for var in factors:
+                codes, _ = self._lookup(var, df[var])
+                if self.method == 'target':
+                    values = _smoothed_means(codes, y, len(self.categories[var]), self.smoothing)
+                else:
+                    values = np.bincount(codes[codes >= 0], minlength = len(self.categories[var]))
+                    if self.method == 'frequency':
+                        values = values / df.shape[0]
+                self.values[var] = values.tolist()
+        return self
+
+    def transform(self, df):
+        '''
+        Encodes categorical features with the learned levels.
+
+        --------------------
+        Arguments:
+        - df (pandas DF): data to encode
+
+        --------------------
+        Returns:
+        - pandas DF with encoded factors
+        '''
+
+        # check fit
+        if self.categories is None:
+            raise ValueError('FactorEncoder must be fitted before transform()')
+
+        # copy df
+        df_new = df.copy()
+
+        # sparse dummy and hash encoding
+        if ((self.method == 'dummy') and self.sparse) or (self.method == 'hash'):
+            dummies = pd.DataFrame.sparse.from_spmatrix(self.transform_sparse(df_new), 
+                                                        index   = df_new.index, 
+                                                        columns = self.get_feature_names())
+            return pd.concat([df_new.drop(list(self.categories), axis = 1), dummies], axis = 1)
+
+        # look up codes
+        for var, categories in self.categories.items():
+            codes, unknown = self._lookup(var, df_new[var])
+
+            # label encoding
+            if self.method == 'label':
+                codes[unknown] = self.unknown_value
+                df_new[var]    = codes
+
+            # prepare dummy encoding
+            if self.method == 'dummy':
+                df_new[var] = pd.Categorical.from_codes(codes, categories = categories)
+
+            # count, frequency and target encoding
+            if self.method in ['count', 'frequency', 'target']:
+                default     = self.target_mean if self.method == 'target' else 0
+                values      = np.append(self.values[var], default)
+                df_new[var] = values[codes]
+
+        # dummy encoding
+        if self.method == 'dummy':
+            df_new = pd.get_dummies(df_new, columns = list(self.categories), drop_first = False)
+
+        # return data
+        return df_new
+
+    def fit_transform(self, df):
+        '''
+        Learns the levels of categorical features and encodes them. Target 
+        encoding of the training data is computed out-of-fold.
+
+        --------------------
+        Arguments:
+        - df (pandas DF): training data
+
+        --------------------
+        Returns:
+        - pandas DF with encoded factors
+        '''
+
+        # fit encoder
+        self.fit(df)
+        if self.method != 'target':
+            return self.transform(df)
+
+        # assign folds
+        y      = df[self.target].values.astype(float)
+        random = np.random.RandomState(self.random_state)
+        folds  = random.permutation(df.shape[0]) % self.n_folds
+
+        # out-of-fold target encoding
+        df_new = df.copy()
+        for var in self.categories:
+            codes, _ = self._lookup(var, df[var])
+            encoded  = np.empty(df.shape[0])
+            for fold in range(self.n_folds):
+                is_train    = folds != fold
+                target_mean = np.nanmean(y[is_train])
+                values      = _smoothed_means(codes[is_train], y[is_train], 
+                                              len(self.categories[var]), self.smoothing, target_mean)
+                encoded[~is_train] = np.append(values, target_mean)[codes[~is_train]]
+            df_new[var] = encoded
+        return df_new
+
+    def transform_sparse(self, df):
+        '''
+        Performs dummy or hash encoding of categorical features and returns the 
+        binary features as a sparse matrix. Columns are named as returned by 
+        get_feature_names().
+
+        --------------------
+        Arguments:
+        - df (pandas DF): data to encode
+
+        --------------------
+        Returns:
+        - scipy.sparse CSR matrix with binary features
+        '''
+
+        # check fit
+        if self.categories is None:
+            raise ValueError('FactorEncoder must be fitted before transform_sparse()')
+        if self.method not in ['dummy', 'hash']:
+            raise ValueError('transform_sparse() requires dummy or hash encoding')
+
+        # collect non-zero entries
+        rows, cols, offset = [], [], 0
+        for var, categories in self.categories.items():
+            if self.method == 'hash':
+                codes, n_cols = _hash_codes(df[var], self.n_buckets), self.n_buckets
+            else:
+                codes, n_cols = self._lookup(var, df[var])[0], len(categories)
+            known = codes >= 0
+            rows.append(np.flatnonzero(known))
+            cols.append(codes[known] + offset)
+            offset += n_cols
+
+        # build matrix
+        rows = np.concatenate(rows)
+        data = np.ones(len(rows), dtype = np.uint8)
+        return scipy.sparse.csr_matrix((data, (rows, np.concatenate(cols))), shape = (df.shape[0], offset))
+
+    def get_feature_names(self):
+        '''
+        Returns the names of dummy or hash features.
+
+        --------------------
+        Returns:
+        - list of feature names
+        '''
+        if self.method == 'hash':
+            return ['{}_hash_{}'.format(var, k) for var in self.categories for k in range(self.n_buckets)]
+        return ['{}_{}'.format(var, level) for var, categories in self.categories.items() for level in categories]
+
+    def save(self, file_path):
+        '''
+        Saves the fitted encoder as a JSON file. Factors and their levels are 
+        stored as ordered lists of pairs, so that names and levels that are 
+        numbers are restored as numbers. Names and levels must be strings, 
+        numbers or booleans.
+
+        --------------------
+        Arguments:
+        - file_path (str): file path including the file name
+        '''
+        state = dict(self.__dict__)
+        state['factors'] = _json_scalars(self.factors, 'factor names')
+        state['target']  = _json_scalars(self.target, 'target names')
+        for attr in ['categories', 'values']:
+            if state[attr] is not None:
+                state[attr] = [[_json_scalars(var, 'factor names'), _json_scalars(values, 'factor levels')] 
+                               for var, values in state[attr].items()]
+        with open(file_path, 'w') as f:
+            json.dump(state, f)
+
+    @classmethod
+    def load(cls, file_path):
+        '''
+        Loads an encoder saved with save().
+
+        --------------------
+        Arguments:
+        - file_path (str): file path including the file name
+
+        --------------------
+        Returns:
+        - fitted encoder
+        '''
+        with open(file_path) as f:
+            state = json.load(f)
+        for attr in ['categories', 'values']:
+            if state[attr] is not None:
+                state[attr] = {var: values for var, values in state[attr]}
+        encoder = cls(method = state['method'], target = state['target'])
+        encoder.__dict__.update(state)
+        return encoder
+
+    def _lookup(self, var, values):
+        '''
+        Looks up the codes of a categorical feature. Returns the codes with -1 
+        for missing and unknown levels and the mask of unknown levels.
+        '''
+        categories = self.categories[var]
+        codes      = pd.Index(categories).get_indexer(values)
+        unknown    = (codes == -1) & pd.notnull(values).values
+
+        # merge remaining levels
+        if (self.max_levels is not None) and (len(categories) > self.max_levels):
+            codes[unknown] = len(categories) - 1
+            unknown[:]     = False
+
+        # check unknown levels
+        if unknown.any() and (self.handle_unknown == 'error'):
+            raise ValueError('Found unknown levels in {}: {}'.format(var, list(pd.unique(values[unknown]))[:5]))
+        return codes, unknown
+
+
+def _json_scalars(values, name):
+    '''
+    Converts a value or a list of values to Python scalars that are restored 
+    unchanged from JSON. Raises an error for other types.
+    '''
+    if isinstance(values, list):
+        return [_json_scalars(value, name) for value in values]
+    if isinstance(values, np.generic):
+        values = values.item()
+    if (values is not None) and not isinstance(values, (str, int, float, bool)):
+        raise ValueError('FactorEncoder can only save {} that are strings, numbers or booleans, found {}'.format(
+            name, type(values).__name__))
+    return values
+
 
-    # return data
-    return df_new
\ No newline at end of file
+def _smoothed_means(codes, y, n_levels, smoothing, target_mean = None):
+    '''
+    Computes target means per level shrunk towards the overall target mean. 
+    Rows with missing levels or targets are ignored. Levels without rows get 
+    the target mean.
+    '''
+    if target_mean is None:
+        target_mean = np.nanmean(y)
+    known  = (codes >= 0) & ~np.isnan(y)
+    sums   = np.bincount(codes[known], weights = y[known], minlength = n_levels)
+    counts = np.bincount(codes[known], minlength = n_levels)
+    weight = counts + smoothing
+    return np.where(weight > 0, (sums + smoothing * target_mean) / np.where(weight > 0, weight, 1), target_mean)
+
+
+def _hash_codes(values, n_buckets):
+    '''
+    Maps values to hash buckets based on their string representation. Returns 
+    -1 for missing values.
+    '''
+    strings = np.asarray(values.astype(str), dtype = object)
+    codes   = (pd.util.hash_array(strings, categorize = False) % np.uint64(n_buckets)).astype(np.int64)
+    codes[pd.isnull(values).values] = -1
+    return codes
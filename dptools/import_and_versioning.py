@@ -4,28 +4,38 @@
 #                             
 ###############################
 
-from os import path
+import os
 import pandas as pd
 
-def save_csv_version(file_path, df, min_version = 1, **args):
+def save_csv_version(file_path, df, min_version = 1, skip_duplicates = False, **args):
     '''
     Saves pandas DF as a csv file with an automatically assigned version number 
     to prevent overwriting the existing file. If no file with the same name 
     exists in the specified path, '_v1' is appended to the file name to indicate 
     the version of the saved data. If such a version already exists, the function 
     iterates over integers and saves the data as '_v[k]', where [k] stands for 
-    the next available integer. 
+    the next available integer. Compression extensions are kept at the end 
+    of the file name, e.g. 'data.csv.gz' is saved as 'data_v1.csv.gz'.
+
+    Existing versions are found with a single directory scan. The data is 
+    written to a temporary file and published under the versioned name with 
+    an exclusive create, so that concurrent calls never overwrite each other.
+
+    With skip_duplicates = True, a content hash of df is stored in a version 
+    manifest next to the file. If df matches the most recently saved version, 
+    it is not saved again and the path of that version is returned.
 
     --------------------
     Arguments:
     - file_path (str): file path including the file name
     - df (pandas DF): dataset
     - min_version (int): minimum version number
+    - skip_duplicates (bool): whether to skip saving if df matches the most recently saved version
     - **args: further arguments to pass to pd.to_csv() function
 
     --------------------
     Returns:
-    - None
+    - path of the saved file
 
     --------------------
     Examples:
@@ -48,26 +58,557 @@ def save_csv_version(file_path, df, min_version = 1, **args):
     save_csv_version('data.csv', df, index = False)
     '''
 
-    # initialize
-    version = min_version - 1
-    is_version_present = True
+    # check duplicates
+    digest    = _hash_frame(df) if skip_duplicates else None
+    duplicate = _find_duplicate(file_path, digest) if skip_duplicates else None
+    if duplicate is not None:
+        print('Data unchanged, most recent version is ' + duplicate)
+        return duplicate
+
+    # save file
+    file_path_version = _save_version(file_path, lambda tmp_path: df.to_csv(tmp_path, **args), 
+                                      min_version, digest)
+    print('Saved as ' + file_path_version)
+    return file_path_version
+
+
+
+###############################
+#                             
+#    SAVE SNAPSHOT VERSION
+#                             
+###############################
+
+import importlib.util
+import json
+import os
+import re
+import uuid
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+def save_snapshot_version(file_path, df, min_version = 1, skip_duplicates = False):
+    '''
+    Saves pandas DF as a binary snapshot with an automatically assigned version 
+    number using the same '_v[k]' naming scheme as save_csv_version(). The 
+    format is inferred from the file extension: '.parquet' and '.feather' 
+    require pyarrow, '.npz' uses NumPy only. Parquet and Feather snapshots fall 
+    back to '.npz' if pyarrow is not installed. 
+
+    Snapshots keep column dtypes including categoricals, nullable dtypes and 
+    sparse columns such as TF-IDF features created by add_text_features(). In 
+    '.npz' snapshots, object columns are restored as strings.
+
+    --------------------
+    Arguments:
+    - file_path (str): file path including the file name
+    - df (pandas DF): dataset
+    - min_version (int): minimum version number
+    - skip_duplicates (bool): whether to skip saving if df matches the most recently saved version
+
+    --------------------
+    Returns:
+    - path of the saved file
 
-    # update name
-    file_path_version = file_path.replace('.csv', ('_v' + str(version) + '.csv'))
+    --------------------
+    Examples:
     
-    # export loop
-    while is_version_present:
+    # import dependencies
+    import pandas as pd
+    import numpy as np
 
-        # update file name
-        version += 1
-        file_path_version = file_path.replace('.csv', ('_v' + str(version) + '.csv'))
+    # create data frame
+    data = {'age': [27, np.nan, 30, 25, np.nan], 
+        'height': [170, 168, 173, 177, 165], 
+        'gender': ['female', 'male', np.nan, 'male', 'female']}
+    df = pd.DataFrame(data)
+    df['gender'] = df['gender'].astype('category')
+
+    # first call saves df as 'data_v1.parquet'
+    from dptools import save_snapshot_version
+    save_snapshot_version('data.parquet', df)
 
-        # check for a file with the same name
-        is_version_present = path.isfile(file_path_version)
+    # second call saves df as 'data_v2.parquet' as data_v1.parquet already exists
+    save_snapshot_version('data.parquet', df)
+    '''
+
+    # check format
+    file_format = _snapshot_format(file_path)
+    if (file_format != 'npz') and (importlib.util.find_spec('pyarrow') is None):
+        print('pyarrow is not installed, saving snapshot as .npz')
+        file_path, file_format = os.path.splitext(file_path)[0] + '.npz', 'npz'
+
+    # check duplicates
+    digest    = _hash_frame(df) if skip_duplicates else None
+    duplicate = _find_duplicate(file_path, digest) if skip_duplicates else None
+    if duplicate is not None:
+        print('Data unchanged, most recent version is ' + duplicate)
+        return duplicate
 
     # save file
-    df.to_csv(file_path_version, **args)
+    if file_format == 'npz':
+        write = lambda tmp_path: _write_npz_snapshot(tmp_path, df)
+    else:
+        write = lambda tmp_path: _write_arrow_snapshot(tmp_path, df, file_format)
+    file_path_version = _save_version(file_path, write, min_version, digest)
     print('Saved as ' + file_path_version)
+    return file_path_version
+
+
+
+###############################
+#                             
+#    LOAD SNAPSHOT VERSION
+#                             
+###############################
+
+def load_snapshot_version(file_path, version = None, memory_map = True):
+    '''
+    Loads a versioned snapshot saved with save_snapshot_version(). Loads the 
+    latest version by default. If no Parquet or Feather snapshot exists, the 
+    '.npz' fallback with the same name is loaded.
+
+    --------------------
+    Arguments:
+    - file_path (str): file path including the file name without version
+    - version (int): version number; loads the latest version if None
+    - memory_map (bool): whether to memory-map Parquet and Feather files
+
+    --------------------
+    Returns:
+    - imported pandas DF
+
+    --------------------
+    Examples:
+
+    # load the latest version of 'data.parquet'
+    from dptools import load_snapshot_version
+    df = load_snapshot_version('data.parquet')
+
+    # load 'data_v1.parquet'
+    df = load_snapshot_version('data.parquet', version = 1)
+    '''
+
+    # check fallback
+    npz_path = os.path.splitext(file_path)[0] + '.npz'
+    if (len(_list_versions(file_path)) == 0) and (len(_list_versions(npz_path)) > 0):
+        file_path = npz_path
+
+    # find version
+    if version is None:
+        versions = _list_versions(file_path)
+        if len(versions) == 0:
+            raise FileNotFoundError(f'No versions of {file_path} found')
+        version = max(versions)
+    file_path_version = _version_path(file_path, version)
+
+    # load file
+    if _snapshot_format(file_path) == 'npz':
+        df = _read_npz_snapshot(file_path_version)
+    else:
+        df = _read_arrow_snapshot(file_path_version, _snapshot_format(file_path), memory_map)
+    print(f'Loaded {os.path.basename(file_path_version)}: {df.shape}')
+    return df
+
+
+###############################
+#                             
+#    FIND MATCHING VERSION
+#                             
+###############################
+
+import hashlib
+
+def find_matching_version(file_path, df):
+    '''
+    Finds the saved version of a file that has the same content as df. Only 
+    versions saved with skip_duplicates = True are considered, since their 
+    content hashes are stored in the version manifest.
+
+    --------------------
+    Arguments:
+    - file_path (str): file path including the file name without version
+    - df (pandas DF): dataset
+
+    --------------------
+    Returns:
+    - path of the latest matching version or None
+
+    --------------------
+    Examples:
+
+    # save data with content hashes
+    from dptools import save_csv_version, find_matching_version
+    save_csv_version('data.csv', df, skip_duplicates = True, index = False)
+
+    # find version with the same content
+    find_matching_version('data.csv', df)
+    '''
+
+    # find versions with the same hash
+    digest   = _hash_frame(df)
+    manifest = _read_manifest(file_path)
+    matches  = [int(version) for version, version_digest in manifest.items() 
+                if (version_digest == digest) and os.path.isfile(_version_path(file_path, version))]
+
+    # return results
+    if len(matches) > 0:
+        return _version_path(file_path, max(matches))
+
+
+def _hash_frame(df):
+    '''
+    Computes a content hash of pandas DF including column names, dtypes and 
+    index from vectorized row hashes.
+    '''
+    digest = hashlib.blake2b(digest_size = 16)
+    digest.update(repr([(str(col), str(dtype)) for col, dtype in df.dtypes.items()]).encode())
+    digest.update(pd.util.hash_pandas_object(df, index = True).values.tobytes())
+    return digest.hexdigest()
+
+
+def _manifest_path(file_path):
+    '''
+    Returns the path of the version manifest.
+    '''
+    return file_path + '.versions.json'
+
+
+def _read_manifest(file_path):
+    '''
+    Reads the version manifest mapping version numbers to content hashes.
+    '''
+    try:
+        with open(_manifest_path(file_path)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _record_version_hash(file_path, version, digest):
+    '''
+    Adds the content hash of a saved version to the version manifest. Entries 
+    are kept in the order of saving, so the last entry is the most recently 
+    saved version. The manifest is replaced atomically; an entry lost to a 
+    concurrent update only disables deduplication for that version.
+    '''
+    manifest = _read_manifest(file_path)
+    manifest.pop(str(version), None)
+    manifest[str(version)] = digest
+    tmp_path = _manifest_path(file_path) + '.' + uuid.uuid4().hex + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent = 1)
+    os.replace(tmp_path, _manifest_path(file_path))
+
+
+def _find_duplicate(file_path, digest):
+    '''
+    Returns the path of the most recently saved version if it has the specified 
+    content hash. Versions are filled into gaps of the version numbers, so the 
+    most recent version is the last entry of the manifest rather than the 
+    highest version number.
+    '''
+    manifest = _read_manifest(file_path)
+    if len(manifest) > 0:
+        version = list(manifest)[-1]
+        if (manifest[version] == digest) and os.path.isfile(_version_path(file_path, version)):
+            return _version_path(file_path, version)
+
+
+def _to_json(value):
+    '''
+    Converts NumPy scalars in snapshot metadata to Python types.
+    '''
+    return value.item()
+
+
+def _split_ext(file_path):
+    '''
+    Splits the file extension from the path. Compression extensions are kept 
+    together with the format extension, e.g. '.csv.gz'.
+    '''
+    root, ext = os.path.splitext(file_path)
+    if ext.lower() in ['.gz', '.bz2', '.zip', '.xz', '.zst']:
+        root, format_ext = os.path.splitext(root)
+        ext = format_ext + ext
+    return root, ext
+
+
+def _version_path(file_path, version):
+    '''
+    Appends the version number to the file name before the extension.
+    '''
+    root, ext = _split_ext(file_path)
+    return f'{root}_v{version}{ext}'
+
+
+def _list_versions(file_path):
+    '''
+    Lists existing version numbers of a file with a single directory scan.
+    '''
+    folder, name = os.path.split(file_path)
+    root, ext    = _split_ext(name)
+    pattern      = re.compile(re.escape(root) + r'_v(\d+)' + re.escape(ext) + '$')
+    if not os.path.isdir(folder or '.'):
+        return []
+    matches = (pattern.match(entry) for entry in os.listdir(folder or '.'))
+    return sorted(int(match.group(1)) for match in matches if match is not None)
+
+
+def _save_version(file_path, write, min_version = 1, digest = None):
+    '''
+    Writes a file with the write function to a temporary path and publishes it 
+    under the smallest free version number not smaller than min_version. 
+    Records the content hash in the version manifest if digest is specified 
+    or a manifest exists, so that the manifest tracks the most recent version. 
+    Returns the path of the published file.
+    '''
+
+    # write temporary file
+    folder, name = os.path.split(file_path)
+    root, ext    = _split_ext(name)
+    tmp_path     = os.path.join(folder, '.' + root + '.' + uuid.uuid4().hex + '.tmp' + ext)
+    try:
+        write(tmp_path)
+
+        # publish version
+        taken   = set(_list_versions(file_path))
+        version = min_version
+        while True:
+            while version in taken:
+                version += 1
+            file_path_version = _version_path(file_path, version)
+            if _publish_file(tmp_path, file_path_version):
+                if (digest is not None) or os.path.isfile(_manifest_path(file_path)):
+                    _record_version_hash(file_path, version, digest)
+                return file_path_version
+            taken.add(version)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _publish_file(tmp_path, file_path):
+    '''
+    Atomically publishes the temporary file under file_path unless file_path 
+    already exists. Uses a hard link where supported and an exclusive create 
+    followed by a rename otherwise. Returns False if file_path exists.
+    '''
+    try:
+        os.link(tmp_path, file_path)
+        return True
+    except FileExistsError:
+        return False
+    except OSError:
+        pass
+    try:
+        os.close(os.open(file_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return False
+    os.replace(tmp_path, file_path)
+    return True
+
+
+def _snapshot_format(file_path):
+    '''
+    Infers the snapshot format from the file extension.
+    '''
+    file_format = os.path.splitext(file_path)[1].lstrip('.').lower()
+    if file_format not in ['parquet', 'feather', 'npz']:
+        raise ValueError('file_path must end with .parquet, .feather or .npz')
+    return file_format
+
+
+def _write_arrow_snapshot(file_path, df, file_format):
+    '''
+    Writes pandas DF as Parquet or Feather. Sparse columns are stored dense 
+    and restored from the schema metadata.
+    '''
+    import pyarrow as pa
+    import pyarrow.feather
+    import pyarrow.parquet
+
+    # densify sparse columns
+    sparse = {str(col): df[col].sparse.fill_value for col in df.columns 
+              if isinstance(df[col].dtype, pd.SparseDtype)}
+    if len(sparse) > 0:
+        df = df.copy()
+        for col in df.columns:
+            if str(col) in sparse:
+                df[col] = df[col].sparse.to_dense()
+
+    # convert to arrow
+    table    = pa.Table.from_pandas(df)
+    metadata = dict(table.schema.metadata or {})
+    metadata[b'dptools'] = json.dumps({'sparse': sparse}, default = _to_json).encode()
+    table    = table.replace_schema_metadata(metadata)
+
+    # write file
+    if file_format == 'parquet':
+        pyarrow.parquet.write_table(table, file_path)
+    else:
+        pyarrow.feather.write_feather(table, file_path, compression = 'uncompressed')
+
+
+def _read_arrow_snapshot(file_path, file_format, memory_map = True):
+    '''
+    Reads Parquet or Feather snapshot as pandas DF.
+    '''
+    import pyarrow.feather
+    import pyarrow.parquet
+
+    # read file
+    if file_format == 'parquet':
+        table = pyarrow.parquet.read_table(file_path, memory_map = memory_map)
+    else:
+        table = pyarrow.feather.read_table(file_path, memory_map = memory_map)
+    df = table.to_pandas()
+
+    # restore sparse columns
+    metadata = json.loads((table.schema.metadata or {}).get(b'dptools', b'{}'))
+    for col in df.columns:
+        if str(col) in metadata.get('sparse', {}):
+            df[col] = pd.arrays.SparseArray(df[col], fill_value = metadata['sparse'][str(col)])
+    return df
+
+
+def _write_npz_snapshot(file_path, df):
+    '''
+    Writes pandas DF as uncompressed .npz with one or more arrays per column 
+    and a JSON header describing the columns.
+    '''
+    arrays = {}
+    header = {'columns': [], 'n_rows': df.shape[0], 
+              'column_names': [_npz_name(name) for name in df.columns.names]}
+
+    # encode columns
+    for i, col in enumerate(df.columns):
+        header['columns'].append(_encode_npz_array(df.iloc[:, i].array, 'c' + str(i), arrays))
+        header['columns'][-1]['name'] = _npz_name(col)
+
+    # encode index
+    if isinstance(df.index, pd.RangeIndex):
+        header['index'] = {'kind': 'range', 'start': df.index.start, 'stop': df.index.stop, 
+                           'step': df.index.step, 'name': _npz_name(df.index.name)}
+    else:
+        header['index'] = _encode_npz_array(df.index.array, 'index', arrays)
+        header['index']['name'] = _npz_name(df.index.name)
+
+    # write file
+    arrays['header'] = np.array(json.dumps(header, default = _to_json))
+    with open(file_path, 'wb') as f:
+        np.savez(f, **arrays)
+
+
+def _read_npz_snapshot(file_path):
+    '''
+    Reads .npz snapshot as pandas DF.
+    '''
+    with np.load(file_path, allow_pickle = False) as arrays:
+        header = json.loads(arrays['header'].item())
+        data   = {}
+        for i, meta in enumerate(header['columns']):
+            data[i] = _decode_npz_array(meta, 'c' + str(i), arrays, header['n_rows'])
+        if header['index']['kind'] == 'range':
+            index = pd.RangeIndex(header['index']['start'], header['index']['stop'], header['index']['step'])
+        else:
+            index = pd.Index(_decode_npz_array(header['index'], 'index', arrays, header['n_rows']))
+    index.name = _restore_npz_name(header['index']['name'])
+    df = pd.DataFrame(data, index = index)
+    df.columns = pd.Index([_restore_npz_name(meta['name']) for meta in header['columns']], tupleize_cols = True)
+    df.columns.names = [_restore_npz_name(name) for name in header['column_names']]
+    return df
+
+
+def _npz_name(name):
+    '''
+    Converts a column or index name to a value that is restored unchanged 
+    from the JSON header. Tuples are stored as lists. Raises an error for 
+    other types.
+    '''
+    if isinstance(name, tuple):
+        return [_npz_name(level) for level in name]
+    if isinstance(name, np.generic):
+        name = name.item()
+    if (name is not None) and not isinstance(name, (str, int, float, bool)):
+        raise ValueError('.npz snapshots can only store names that are strings, numbers, booleans '
+                         'or tuples of them, found {}'.format(type(name).__name__))
+    return name
+
+
+def _restore_npz_name(name):
+    '''
+    Restores a column or index name stored with _npz_name().
+    '''
+    if isinstance(name, list):
+        return tuple(_restore_npz_name(level) for level in name)
+    return name
+
+
+def _encode_npz_array(values, key, arrays):
+    '''
+    Stores a pandas array in the dictionary of NumPy arrays and returns its 
+    description.
+    '''
+    dtype = values.dtype
+    if isinstance(dtype, pd.SparseDtype):
+        arrays[key + '_indices'] = values.sp_index.indices
+        arrays[key + '_values']  = values.sp_values
+        return {'kind': 'sparse', 'fill_value': values.fill_value}
+    if isinstance(dtype, pd.CategoricalDtype):
+        arrays[key + '_codes'] = values.codes
+        return {'kind': 'category', 'ordered': bool(dtype.ordered), 
+                'categories': _encode_npz_array(values.categories.array, key + '_categories', arrays)}
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        arrays[key] = values.tz_convert('UTC').tz_localize(None).to_numpy()
+        return {'kind': 'datetimetz', 'tz': str(dtype.tz)}
+    if isinstance(values, (pd.arrays.IntegerArray, pd.arrays.FloatingArray, pd.arrays.BooleanArray)):
+        arrays[key]           = values._data
+        arrays[key + '_mask'] = values._mask
+        return {'kind': 'masked', 'dtype': str(dtype)}
+    if isinstance(values, (pd.arrays.PandasArray, pd.arrays.DatetimeArray, pd.arrays.TimedeltaArray)):
+        if values.to_numpy().dtype != object:
+            arrays[key] = values.to_numpy()
+            return {'kind': 'dense'}
+    mask = pd.isnull(np.asarray(values, dtype = object))
+    arrays[key]           = np.where(mask, '', np.asarray(values, dtype = object)).astype(str)
+    arrays[key + '_mask'] = mask
+    if isinstance(dtype, pd.StringDtype):
+        return {'kind': 'object', 'dtype': str(dtype)}
+    return {'kind': 'object'}
+
+
+def _decode_npz_array(meta, key, arrays, n_rows):
+    '''
+    Restores a pandas array from the dictionary of NumPy arrays.
+    '''
+    if meta['kind'] == 'sparse':
+        sp_values  = arrays[key + '_values']
+        sp_indices = arrays[key + '_indices']
+        if meta['fill_value'] == 0:
+            matrix = scipy.sparse.csc_matrix((sp_values, sp_indices, [0, len(sp_indices)]), 
+                                             shape = (n_rows, 1))
+            return pd.arrays.SparseArray.from_spmatrix(matrix)
+        dense = np.full(n_rows, meta['fill_value'], dtype = sp_values.dtype)
+        dense[sp_indices] = sp_values
+        return pd.arrays.SparseArray(dense, fill_value = meta['fill_value'])
+    if meta['kind'] == 'category':
+        categories = _decode_npz_array(meta['categories'], key + '_categories', arrays, None)
+        return pd.Categorical.from_codes(arrays[key + '_codes'], categories = categories, 
+                                         ordered = meta['ordered'])
+    if meta['kind'] == 'datetimetz':
+        return pd.DatetimeIndex(arrays[key]).tz_localize('UTC').tz_convert(meta['tz']).array
+    if meta['kind'] == 'dense':
+        return arrays[key]
+    if meta['kind'] == 'masked':
+        array_type = pd.api.types.pandas_dtype(meta['dtype']).construct_array_type()
+        return array_type(arrays[key], arrays[key + '_mask'])
+    values = arrays[key].astype(object)
+    values[arrays[key + '_mask']] = np.nan
+    if 'dtype' in meta:
+        return pd.array(values, dtype = meta['dtype'])
+    return values
 
 
 
@@ -78,39 +619,156 @@ def save_csv_version(file_path, df, min_version = 1, **args):
 ###############################
 
 from pandas.io.json import json_normalize
+from concurrent.futures import ProcessPoolExecutor
+import importlib.util
 import json
 import os
 
-def read_csv_with_json(file_path, json_cols, **args):
+def read_csv_with_json(file_path, 
+                       json_cols, 
+                       chunksize   = None, 
+                       output_path = None, 
+                       decoder     = 'json',
+                       n_jobs      = 1,
+                       **args):
     '''
     Imports csv where some columns are JSON-encoded as pandas DF. 
 
+    If chunksize is specified, the file is processed in chunks of chunksize 
+    rows and the function returns an iterator over the normalized chunks. 
+    All chunks share the same columns: a first pass over the file collects 
+    the union of the flattened JSON keys, and the second pass yields chunks 
+    reindexed to that schema. Peak memory depends on chunksize only.
+
+    JSON columns are decoded with the specified decoder and flattened 
+    independently of each other, which allows processing them in parallel 
+    worker processes with n_jobs > 1.
+
     --------------------
     Arguments:
     - file_path (str): file path including the file name
     - json_cols (list): list of JSON-encoded columns
+    - chunksize (int): number of rows per chunk; imports the full file if None
+    - output_path (str): path of the csv file to write the normalized chunks to
+    - decoder (str): JSON decoder: 'json', 'orjson', 'ujson' or 'auto' to use the fastest installed one
+    - n_jobs (int): number of worker processes for decoding and flattening JSON columns
     - **args: further arguments to pass to pd.read_csv() function
 
     --------------------
     Returns:
-    - imported pandas DF
+    - imported pandas DF if chunksize is None
+    - iterator over pandas DF chunks if chunksize is specified
+    - None if output_path is specified
+
+    --------------------
+    Examples:
+
+    # import full file
+    from dptools import read_csv_with_json
+    df = read_csv_with_json('events.csv', json_cols = ['payload'])
+
+    # decode two JSON columns in parallel with orjson
+    df = read_csv_with_json('events.csv', json_cols = ['payload', 'meta'], decoder = 'orjson', n_jobs = 2)
+
+    # iterate over normalized chunks
+    for chunk in read_csv_with_json('events.csv', json_cols = ['payload'], chunksize = 100000):
+        print(chunk.shape)
+
+    # write normalized chunks to a new file
+    read_csv_with_json('events.csv', json_cols = ['payload'], chunksize = 100000, 
+                       output_path = 'events_flat.csv')
     '''
-        
-    # import data frame
-    df = pd.read_csv(file_path, 
-                     converters = {column: json.loads for column in json_cols}, 
-                     **args)
-    
+
     # convert to list
     if not isinstance(json_cols, list):
         json_cols = [json_cols]
-    
-    # extract values
-    for column in json_cols:
-        column_as_df = json_normalize(df[column])
-        column_as_df.columns = [f'{column}_{subcolumn}' for subcolumn in column_as_df.columns]
-        df = df.drop(column, axis = 1).merge(column_as_df, right_index = True, left_index = True)
-
-    # return data
-    print(f'Loaded {os.path.basename(path)}: {df.shape}')
-    return df
\ No newline at end of file
+
+    # check decoder
+    decoder = _get_json_decoder(decoder)
+
+    # import full data frame
+    if chunksize is None:
+        df = next(_read_json_chunks(file_path, json_cols, None, decoder, n_jobs, **args))
+        if output_path is not None:
+            df.to_csv(output_path, index = False)
+            print(f'Saved {os.path.basename(output_path)}: {df.shape}')
+            return None
+        print(f'Loaded {os.path.basename(file_path)}: {df.shape}')
+        return df
+
+    # collect union schema
+    columns = []
+    for chunk in _read_json_chunks(file_path, json_cols, chunksize, decoder, n_jobs, **args):
+        columns += [col for col in chunk.columns if col not in columns]
+
+    # stream chunks
+    chunks = (chunk.reindex(columns = columns) for chunk in 
+              _read_json_chunks(file_path, json_cols, chunksize, decoder, n_jobs, **args))
+    if output_path is None:
+        return chunks
+
+    # export chunks
+    n_rows = 0
+    for i, chunk in enumerate(chunks):
+        chunk.to_csv(output_path, mode = 'w' if i == 0 else 'a', header = (i == 0), index = False)
+        n_rows += chunk.shape[0]
+    print(f'Saved {os.path.basename(output_path)}: {(n_rows, len(columns))}')
+
+
+def _get_json_decoder(decoder):
+    '''
+    Checks that the JSON decoder is available and returns its module name.
+    '''
+    decoders = ['orjson', 'ujson', 'json']
+    if decoder == 'auto':
+        return next(name for name in decoders if importlib.util.find_spec(name) is not None)
+    if decoder not in decoders:
+        raise ValueError(f'decoder must be one of {decoders} or \'auto\'')
+    if importlib.util.find_spec(decoder) is None:
+        raise ImportError(f'decoder \'{decoder}\' requires the {decoder} package')
+    return decoder
+
+
+def _read_json_chunks(file_path, json_cols, chunksize, decoder, n_jobs, **args):
+    '''
+    Yields normalized chunks of a csv with JSON-encoded columns. Yields the 
+    full data frame as a single chunk if chunksize is None.
+    '''
+    reader = pd.read_csv(file_path, 
+                         converters = {column: str for column in json_cols}, 
+                         chunksize  = chunksize, 
+                         **args)
+    if chunksize is None:
+        reader = [reader]
+    if n_jobs > 1:
+        with ProcessPoolExecutor(max_workers = n_jobs) as executor:
+            for chunk in reader:
+                yield _normalize_json_columns(chunk, json_cols, decoder, executor)
+    else:
+        for chunk in reader:
+            yield _normalize_json_columns(chunk, json_cols, decoder)
+
+
+def _normalize_json_columns(df, json_cols, decoder = 'json', executor = None):
+    '''
+    Replaces JSON-encoded columns with their flattened subcolumns. Flattened 
+    columns are joined by position and placed after the other columns.
+    '''
+    tasks = [(df[column].tolist(), column, decoder) for column in json_cols]
+    if executor is not None:
+        flat_dfs = list(executor.map(_flatten_json_column, *zip(*tasks)))
+    else:
+        flat_dfs = [_flatten_json_column(*task) for task in tasks]
+    for column_as_df in flat_dfs:
+        column_as_df.index = df.index
+    return pd.concat([df.drop(json_cols, axis = 1)] + flat_dfs, axis = 1)
+
+
+def _flatten_json_column(values, column, decoder = 'json'):
+    '''
+    Decodes JSON strings and flattens them into a pandas DF.
+    '''
+    loads = importlib.import_module(decoder).loads
+    column_as_df = json_normalize([loads(value) for value in values])
+    column_as_df.columns = [f'{column}_{subcolumn}' for subcolumn in column_as_df.columns]
+    return column_as_df
@@ -4,6 +4,7 @@ import pytest
 
 from dptools import find_constant_features
 from dptools import find_correlated_features
+from dptools import CorrelationScreen
 
 def test_find_constant_features_1():
     data = {'age': [27, np.nan, 30, 25, np.nan], 
@@ -19,6 +20,34 @@ def test_find_constant_features_0():
     df = pd.DataFrame(data)
     assert find_constant_features(df) == None
 
+def test_find_constant_features_chunks():
+    data = {'age': [27, np.nan, 30, 25, np.nan, 27], 
+        'height': [170, 170, 170, 170, 170, 170], 
+        'weight': [np.nan, 70, 70, 70, 70, 70], 
+        'gender': ['male', 'female', 'female', 'female', 'female', 'female'], 
+        'size': pd.array([2, 2, 2, 2, 2, 3], dtype = 'Int64')}
+    df = pd.DataFrame(data)
+    assert find_constant_features(df, chunk_size = 2) == ['height']
+    assert find_constant_features(df, dropna = True, chunk_size = 4) == ['height', 'weight']
+    assert find_constant_features(df, threshold = 0.8, chunk_size = 4) == ['height', 'weight', 'gender', 'size']
+    chunks = (df.iloc[i:(i + 2)] for i in range(0, df.shape[0], 2))
+    assert find_constant_features(chunks, dropna = True) == ['height', 'weight']
+    chunks = (df.iloc[i:(i + 2)] for i in range(0, df.shape[0], 2))
+    assert find_constant_features(chunks, threshold = 0.8) == ['height', 'weight', 'gender', 'size']
+    with pytest.raises(ValueError):
+        find_constant_features(df, threshold = 0)
+
+def test_find_constant_features_nullable():
+    df = pd.DataFrame({'count': pd.array([1, 1, None, 1], dtype = 'Int64'), 
+        'name': pd.array(['a', None, 'a', 'a'], dtype = 'string'), 
+        'flag': pd.array([True, None, False, True], dtype = 'boolean'), 
+        'share': pd.array([None, None, None, None], dtype = 'Float64')})
+    for dropna in [False, True]:
+        expected = list(df.columns[df.nunique(dropna = dropna) == 1]) or None
+        assert find_constant_features(df, dropna = dropna, chunk_size = 2) == expected
+    assert find_constant_features(df, dropna = True) == ['count', 'name']
+    assert find_constant_features(df, dropna = True, threshold = 0.6) == ['count', 'name', 'flag']
+
 def find_correlated_features_1():
     data = {'age': [30, 25, 30, 35, 18], 
         'height': [170, 168, 173, 177, 165], 
@@ -31,4 +60,45 @@ def find_correlated_features_0():
         'height': [170, 168, 173, 177, 165], 
         'gender': ['female', 'female', 'female', 'female', 'female']}
     df = pd.DataFrame(data)
-    assert find_correlated_features(df, cutoff = 0.9, method = 'pearson') == None
\ No newline at end of file
+    assert find_correlated_features(df, cutoff = 0.9, method = 'pearson') == None
+
+def test_find_correlated_features_blocked():
+    data = {'age': [30, 25, 30, 35, 18, np.nan], 
+        'height': [170, 168, 173, 177, 165, 180], 
+        'weight': [71, 66, 74, 80, 60, 85], 
+        'score': [3, 9, 1, 7, 5, 2], 
+        'gender': ['female', 'female', 'female', 'female', 'female', 'male']}
+    df = pd.DataFrame(data)
+    for method in ['pearson', 'spearman', 'both']:
+        features = find_correlated_features(df, cutoff = 0.8, method = method)
+        assert find_correlated_features(df, cutoff = 0.8, method = method, block_size = 2) == features
+        sampled  = find_correlated_features(df, cutoff = 0.8, method = method, sample_size = 5, random_state = 1)
+        assert set(sampled or []) <= set(features)
+    assert find_correlated_features(df, cutoff = 0.8, block_size = 2) == ['age', 'height']
+
+def test_correlation_screen():
+    data = {'age': [30, 25, 30, 35, 18, np.nan], 
+        'height': [170, 168, 173, 177, 165, 180], 
+        'weight': [71, 66, 74, 80, 60, 85], 
+        'score': [3, 9, 1, 7, 5, 2]}
+    df = pd.DataFrame(data)
+    screen = CorrelationScreen(df, block_size = 2, n_jobs = 2)
+    for cutoff in [0.5, 0.9, 0.8]:
+        for method in ['pearson', 'spearman', 'both']:
+            assert screen.find(cutoff, method) == (find_correlated_features(df, cutoff, method) or [])
+    pairs = screen.pairs(cutoff = 0.9)
+    assert pairs[['feature_1', 'feature_2']].values.tolist() == [['height', 'weight'], ['age', 'weight'], ['age', 'height']]
+    np.testing.assert_allclose(pairs['corr'], [df.corr().loc[a, b] for a, b in pairs[['feature_1', 'feature_2']].values])
+
+def test_find_correlated_features_graph():
+    rng = np.random.RandomState(0)
+    x1, x2 = rng.randn(50), rng.randn(50)
+    df = pd.DataFrame({'a': x1, 'b': x1 + x2, 'c': x2})
+    df.loc[:4, 'b'] = np.nan
+    assert find_correlated_features(df, cutoff = 0.6) == ['a', 'b']
+    assert find_correlated_features(df, cutoff = 0.6, strategy = 'graph', keep = 'missing') == ['b']
+    df = pd.DataFrame({'a': x1, 'b': 3 * x1, 'c': x1 + 0.01 * x2, 'd': x2})
+    assert find_correlated_features(df, cutoff = 0.9, strategy = 'graph') == ['a', 'c']
+    assert find_correlated_features(df, cutoff = 0.9, strategy = 'graph', sample_size = 25, random_state = 0) == ['a', 'c']
+    with pytest.raises(ValueError):
+        find_correlated_features(df, strategy = 'cluster')
@@ -4,8 +4,13 @@ import pytest
 
 from dptools import add_date_features
 from dptools import add_text_features
+from dptools import TextEncoder
+from dptools import add_text_hash_features
 from dptools import aggregate_data
+from dptools import aggregate_windows
+from dptools import AggregationState
 from dptools import encode_factors
+from dptools import FactorEncoder
 
 def test_aggregate_data_6():
     data = {'age': [27, np.nan, 30, 25, np.nan], 
@@ -31,6 +36,109 @@ def test_aggregate_data_8():
                         fac_stats = ['mode', 'count'])   
     assert df.shape[1] == 9
 
+def test_aggregate_data_mode():
+    data = {'gender': ['female', 'male', 'female', 'male', 'female', 'male'],
+        'income': ['low', 'high', 'high', np.nan, 'low', 'medium']}
+    df = pd.DataFrame(data)
+    df = aggregate_data(df, 
+                        group_var = 'gender', 
+                        fac_stats = ['count', 'mode'])
+    assert list(df['income_mode']) == ['low', 'high']
+    assert list(df['income_count']) == [3, 2]
+
+def test_aggregate_data_chunks():
+    data = {'age': [27, np.nan, 30, 25, np.nan, 41], 
+        'height': [170, 168, 173, 177, 165, 180], 
+        'gender': ['female', 'male', np.nan, 'male', 'female', 'male'],
+        'income': ['high', 'medium', 'low', 'low', 'no income', 'low']}
+    df = pd.DataFrame(data)
+    stats = dict(group_var = 'gender', num_stats = ['mean', 'std', 'max'], fac_stats = ['count', 'mode'])
+    df_full   = aggregate_data(df, **stats)
+    df_chunks = aggregate_data((df.iloc[i:(i + 2)] for i in range(0, 6, 2)), **stats)
+    pd.testing.assert_frame_equal(df_full[df_chunks.columns], df_chunks)
+
+def test_aggregate_data_chunks_dtypes():
+    chunks = [pd.DataFrame({'id': [1, 2], 'amount': [1, 2], 'note': [np.nan, np.nan]}), 
+              pd.DataFrame({'id': [1, 2], 'amount': [2.5, 4.0], 'note': ['a', 'b']}), 
+              pd.DataFrame({'id': [1, 2], 'amount': [3, 5], 'note': ['a', 'c']})]
+    stats = dict(group_var = 'id', num_stats = ['sum', 'min', 'max'], fac_stats = ['count', 'mode'])
+    df_full   = aggregate_data(pd.concat(chunks, ignore_index = True), **stats)
+    df_chunks = aggregate_data(iter(chunks), **stats)
+    assert list(df_chunks['amount_sum']) == [6.5, 11.0]
+    pd.testing.assert_frame_equal(df_full[df_chunks.columns], df_chunks)
+    chunks[0]['note'] = [1.5, 2.5]
+    with pytest.raises(ValueError):
+        aggregate_data(iter(chunks), **stats)
+
+def test_aggregation_state_update(tmp_path):
+    data = {'age': [27, np.nan, 30, 25, np.nan, 41], 
+        'height': [170, 168, 173, 177, 165, 180], 
+        'gender': ['female', 'male', 'other', 'male', 'female', 'male'],
+        'income': ['high', 'medium', np.nan, 'low', 'no income', 'low']}
+    df = pd.DataFrame(data)
+    stats = dict(group_var = 'gender', num_stats = ['count', 'mean', 'std', 'min'], fac_stats = ['count', 'mode'])
+    state = AggregationState(**stats).update(df.iloc[:4])
+    state.save(tmp_path / 'state.pkl')
+    state = AggregationState.load(tmp_path / 'state.pkl').update(df.iloc[4:])
+    df_full = aggregate_data(df, **stats)
+    df_inc  = state.result()
+    pd.testing.assert_frame_equal(df_full[df_inc.columns], df_inc)
+
+def test_aggregation_state_float_delta(tmp_path):
+    history = pd.DataFrame({'id': [1, 1, 2], 'amount': [3, 5, 4]})
+    delta   = pd.DataFrame({'id': [1, 3], 'amount': [2.5, 0.5]})
+    stats = dict(group_var = 'id', num_stats = ['sum', 'min', 'max'], fac_stats = [])
+    AggregationState(**stats).update(history).save(tmp_path / 'state.pkl')
+    df_inc  = AggregationState.load(tmp_path / 'state.pkl').update(delta).result()
+    df_full = aggregate_data(pd.concat([history, delta], ignore_index = True), **stats)
+    assert list(df_inc['amount_min']) == [2.5, 4.0, 0.5]
+    assert list(df_inc['amount_sum']) == [10.5, 4.0, 0.5]
+    pd.testing.assert_frame_equal(df_full[df_inc.columns], df_inc)
+
+def test_aggregate_data_parallel():
+    data = {'id': [1, 2, 3, 1, 2, 3, 4, 4], 
+        'height': [170, 168, 173, 177, 165, 180, 150, 155], 
+        'income': ['high', 'medium', 'low', 'low', 'medium', 'low', 'high', 'high']}
+    df = pd.DataFrame(data)
+    df_serial   = aggregate_data(df, group_var = 'id')
+    df_parallel = aggregate_data(df, group_var = 'id', n_jobs = 2)
+    pd.testing.assert_frame_equal(df_serial, df_parallel)
+
+def test_aggregate_data_fused_stats():
+    data = {'id': [1, 2, 1, 2, 1, 3], 
+        'age': [np.nan, 30, 25, np.nan, 41, np.nan], 
+        'height': [170, 168, 173, 177, 165, 180]}
+    df = pd.DataFrame(data)
+    stats = ['count', 'sum', 'mean', 'std', 'min', 'max', 'first', 'last']
+    df_agg = aggregate_data(df, group_var = 'id', num_stats = stats)
+    df_pd  = df.groupby('id').agg(stats)
+    df_pd.columns = ['_'.join(col) for col in df_pd.columns]
+    pd.testing.assert_frame_equal(df_agg.set_index('id')[df_pd.columns], df_pd)
+
+def test_aggregate_windows():
+    data = {'customer': ['a', 'b', 'a', 'a', 'b'], 
+        'shop': ['x', 'x', 'y', 'x', 'y'], 
+        'date': pd.to_datetime(['2020-01-01', '2020-01-20', '2020-02-15', '2020-03-01', '2020-03-02']), 
+        'amount': [10, 25, 5, 12, 30]}
+    df = pd.DataFrame(data)
+    aggs = aggregate_windows(df, group_vars = ['customer', 'shop'], date_var = 'date', 
+                             windows = [7, 30, None], num_stats = ['count', 'sum'])
+    assert list(aggs['customer']['amount_sum_7d']) == [12, 30]
+    assert list(aggs['customer']['amount_sum_30d']) == [17, 30]
+    assert list(aggs['shop']['amount_count_all']) == [3, 2]
+
+def test_aggregate_windows_missing_keys():
+    data = {'customer': ['a', np.nan, 'b', 'a', np.nan], 
+        'date': pd.to_datetime(['2020-01-01', '2020-01-20', '2020-02-15', '2020-03-01', '2020-03-02']), 
+        'amount': [10, 25, 5, 12, 1]}
+    df = pd.DataFrame(data)
+    aggs = aggregate_windows(df, group_vars = 'customer', date_var = 'date', 
+                             windows = [7, None], num_stats = ['sum', 'min', 'max'])
+    assert list(aggs['customer']['customer']) == ['a', 'b']
+    assert list(aggs['customer']['amount_sum_all']) == [22, 5]
+    assert list(aggs['customer']['amount_min_all']) == [10, 5]
+    assert list(aggs['customer']['amount_max_7d'].fillna(-1)) == [12, -1]
+
 def test_add_text_features_9():
     data = {'age': [27, np.nan, 30, 25, np.nan], 
         'height': [170, 168, 173, 177, 165], 
@@ -55,6 +163,45 @@ def test_add_text_features_10():
                            drop = True)
     assert df.shape[1] == 10
 
+def test_text_encoder(tmp_path):
+    train = pd.DataFrame({'review': ['Great product!', 'Bad quality, would not buy', 'great value', np.nan]})
+    test  = pd.DataFrame({'review': ['Great quality', 'not great, bad']})
+    encoder   = TextEncoder(text_vars = 'review', tf_idf_feats = 3)
+    train_enc = encoder.fit_transform(train)
+    encoder.save(tmp_path / 'encoder.pkl')
+    encoder  = TextEncoder.load(tmp_path / 'encoder.pkl')
+    test_enc = encoder.transform(test)
+    assert train_enc.columns.tolist() == test_enc.columns.tolist() == encoder.get_feature_names()
+    assert test_enc['review_word_count'].tolist() == [2, 3]
+    assert encoder.transform_sparse(test).shape == (2, 3)
+
+def test_add_text_features_prune_words():
+    data = {'review': ['apple apple apple banana kiwi', 'apple banana cherry', 'kiwi melon apple', 'plum']}
+    df = pd.DataFrame(data)
+    encoder = TextEncoder(text_vars = 'review', tf_idf_feats = 10, common_words = 1, rare_words = 2).fit(df)
+    assert sorted(encoder.vectorizers['review'].vocabulary_) == ['banana', 'cherry', 'kiwi']
+
+def test_add_text_features_stats():
+    data = {'review': ['Great GREAT product!', 'Bad quality, 2 stars', np.nan]}
+    df = pd.DataFrame(data)
+    df = add_text_features(df, text_vars = 'review', text_stats = True, char_tf_idf_feats = 4)
+    np.testing.assert_allclose(df['review_unique_word_ratio'], [2 / 3, 1, 0])
+    np.testing.assert_allclose(df['review_avg_word_length'], [17 / 3, 16 / 4, 0])
+    np.testing.assert_allclose(df['review_upper_ratio'], [6 / 20, 1 / 20, 0])
+    np.testing.assert_allclose(df['review_digit_ratio'], [0, 1 / 20, 0])
+    np.testing.assert_allclose(df['review_punct_ratio'], [1 / 20, 1 / 20, 0])
+    assert df.filter(like = '_char_tfidf_').shape[1] == 4
+
+def test_add_text_hash_features():
+    data = {'age': [27, 30, 25], 
+        'review': ['Great product!', 'Bad quality, would not buy', np.nan]}
+    df = pd.DataFrame(data)
+    df_new, X = add_text_hash_features(df, text_vars = 'review', n_features = 16, chunksize = 2)
+    assert df_new.columns.tolist() == ['age', 'review_word_count', 'review_char_count']
+    assert df_new['review_word_count'].tolist() == [2, 5, 0]
+    assert X.shape == (3, 16)
+    assert X[2].nnz == 0
+
 def test_add_date_features_16():
     data = {'age': [27, 30], 
         'height': [170, 168], 
@@ -64,6 +211,36 @@ def test_add_date_features_16():
     df = add_date_features(df, date_vars = 'date_of_birth', time = False)
     assert df.shape[1] == 16
 
+def test_add_date_features_fast():
+    data = {'age': [27, 30, 25, 41], 
+        'date_of_birth': ['1992-02-29 13:45:10', '1985-12-31 00:00:00', np.nan, '1992-02-29 13:45:10']}
+    df = pd.DataFrame(data)
+    df_slow = add_date_features(df, date_vars = 'date_of_birth', time = True)
+    df_fast = add_date_features(df, date_vars = 'date_of_birth', time = True, fast = True)
+    pd.testing.assert_frame_equal(df_slow, df_fast)
+
+def test_add_date_features_batched():
+    data = {'age': [27, 30, 25], 
+        'birth_date': pd.to_datetime(['1993-02-10', '1985-10-17', '1990-04-08']), 
+        'visit_date': ['2020-01-01 10:00', '2020-01-01 10:00', '2021-06-30 23:59']}
+    df = pd.DataFrame(data)
+    date_vars = ['birth_date', 'visit_date']
+    df_serial   = add_date_features(df, date_vars = date_vars, time = True)
+    df_parallel = add_date_features(df, date_vars = date_vars, time = True, fast = True, n_jobs = 2, copy = False)
+    pd.testing.assert_frame_equal(df_serial, df_parallel)
+    assert df.columns.tolist() == ['age', 'birth_date', 'visit_date']
+
+def test_add_date_features_lookups():
+    data = {'date': pd.to_datetime(['2020-12-24', '2020-12-25', '2020-12-31', np.nan])}
+    df = pd.DataFrame(data)
+    df = add_date_features(df, date_vars = 'date', holidays = ['2020-12-25', '2021-01-01'], 
+                           business_days = True, cyclical = True)
+    assert df['_is_holiday'].tolist() == [False, True, False, False]
+    np.testing.assert_array_equal(df['_days_to_holiday'], [1, 0, 1, np.nan])
+    np.testing.assert_array_equal(df['_business_day_of_month'], [18, 18, 22, np.nan])
+    np.testing.assert_array_equal(df['_business_days_to_month_end'], [4, 4, 0, np.nan])
+    assert df.filter(like = '_sin').shape[1] == 3
+
 def test_encode_factors_label():
     data = {'age': [27, np.nan, 30, 25, np.nan], 
         'height': [170, 168, 173, 177, 165], 
@@ -89,4 +266,77 @@ def test_encode_factors_dummy_7():
         'income': ['high', 'medium', 'low', 'low', 'no income']}
     df = pd.DataFrame(data)
     df = encode_factors(df, factors = 'income', method = 'dummy')
-    assert df.shape[1] == 7
\ No newline at end of file
+    assert df.shape[1] == 7
+
+def test_factor_encoder_label(tmp_path):
+    train = pd.DataFrame({'age': [27, np.nan, 30], 
+        'gender': ['female', 'male', 'male']})
+    test = pd.DataFrame({'age': [25, 31, 40], 
+        'gender': ['male', 'other', np.nan]})
+    encoder = FactorEncoder(method = 'label')
+    assert list(encoder.fit_transform(train)['gender']) == [0, 1, 1]
+    encoder.save(str(tmp_path / 'encoder.json'))
+    encoder = FactorEncoder.load(str(tmp_path / 'encoder.json'))
+    assert list(encoder.transform(test)['gender']) == [1, -1, -1]
+
+def test_factor_encoder_save_names(tmp_path):
+    train = pd.DataFrame({0: ['a', 'b', 'a'], 'size': [3, 1, 3]})
+    encoder = FactorEncoder(factors = [0, 'size'], method = 'count').fit(train)
+    encoder.save(str(tmp_path / 'encoder.json'))
+    loaded = FactorEncoder.load(str(tmp_path / 'encoder.json'))
+    pd.testing.assert_frame_equal(loaded.transform(train), encoder.transform(train))
+    train['date'] = pd.to_datetime(['2020-01-01', '2020-01-02', '2020-01-01'])
+    with pytest.raises(ValueError):
+        FactorEncoder(factors = 'date').fit(train).save(str(tmp_path / 'dates.json'))
+
+def test_factor_encoder_dummy():
+    train = pd.DataFrame({'age': [27, np.nan, 30], 
+        'gender': ['female', 'male', 'male']})
+    test = pd.DataFrame({'age': [25, 31], 
+        'gender': ['male', 'other']})
+    encoder = FactorEncoder(method = 'dummy').fit(train)
+    test_enc = encoder.transform(test)
+    assert list(test_enc.columns) == ['age', 'gender_female', 'gender_male']
+    assert test_enc['gender_male'].tolist() == [1, 0]
+    with pytest.raises(ValueError):
+        FactorEncoder(method = 'dummy', handle_unknown = 'error').fit(train).transform(test)
+
+def test_encode_factors_dummy_sparse():
+    data = {'age': [27, np.nan, 30, 25, np.nan], 
+        'height': [170, 168, 173, 177, 165], 
+        'gender': ['female', 'male', np.nan, 'male', 'female'],
+        'income': ['high', 'medium', 'low', 'low', 'no income']}
+    df = pd.DataFrame(data)
+    df = encode_factors(df, method = 'dummy', sparse = True, max_levels = 2)
+    assert list(df.columns) == ['age', 'height', 'gender_female', 'gender_male', 
+                                'income_high', 'income_low', 'income_other']
+    assert isinstance(df['income_other'].dtype, pd.SparseDtype)
+    assert df['income_other'].sum() == 2
+
+def test_encode_factors_other_label():
+    df = pd.DataFrame({'income': ['other', 'other', 'high', 'low', 'low', 'other', 'high', 'none']})
+    df_enc = encode_factors(df, method = 'dummy', max_levels = 2)
+    assert list(df_enc.columns) == ['income_high', 'income_low', 'income_other']
+    assert df_enc['income_other'].tolist() == [1, 1, 0, 0, 0, 1, 0, 1]
+    encoder = FactorEncoder(method = 'label', max_levels = 2).fit(df)
+    assert encoder.categories['income'] == ['high', 'low', 'other']
+
+def test_encode_factors_hash():
+    data = {'age': [27, np.nan, 30, 25, np.nan], 
+        'height': [170, 168, 173, 177, 165], 
+        'gender': ['female', 'male', np.nan, 'male', 'female'],
+        'income': ['high', 'medium', 'low', 'low', 'no income']}
+    df = pd.DataFrame(data)
+    df = encode_factors(df, method = 'hash', n_buckets = 8)
+    assert df.shape[1] == 18
+    assert df.filter(like = 'gender_hash').sum().sum() == 4
+
+def test_encode_factors_count_target():
+    data = {'age': [27, np.nan, 30, 25, np.nan], 
+        'income': ['high', 'medium', 'low', 'low', 'no income'],
+        'default': [1, 0, 1, 1, 0]}
+    df = pd.DataFrame(data)
+    assert list(encode_factors(df, method = 'count')['income']) == [1, 1, 2, 2, 1]
+    df_enc = encode_factors(df, method = 'target', target = 'default', n_folds = 5, smoothing = 0)
+    assert list(df_enc['income'][2:4]) == [1.0, 1.0]
+    assert df_enc['income'].notnull().all()
@@ -1,10 +1,126 @@
 import numpy as np
 import pandas as pd
 import pytest
+import os
+from concurrent.futures import ThreadPoolExecutor
 
 from dptools import read_csv_with_json
 from dptools import save_csv_version
+from dptools import save_snapshot_version
+from dptools import load_snapshot_version
+from dptools import find_matching_version
 
 # TESTS TBA
 def test_test():
-    assert 1 == 1
\ No newline at end of file
+    assert 1 == 1
+
+def test_read_csv_with_json(tmp_path):
+    file_path = str(tmp_path / 'data.csv')
+    df = pd.DataFrame({'id': [1, 2, 3], 
+        'info': ['{"a": 1, "b": "x"}', '{"a": 2}', '{"c": 3.5}']})
+    df.to_csv(file_path, index = False)
+    df = read_csv_with_json(file_path, json_cols = 'info')
+    assert list(df.columns) == ['id', 'info_a', 'info_b', 'info_c']
+
+def test_read_csv_with_json_chunks(tmp_path):
+    file_path = str(tmp_path / 'data.csv')
+    df = pd.DataFrame({'id': [1, 2, 3], 
+        'info': ['{"a": 1, "b": "x"}', '{"a": 2}', '{"c": 3.5}']})
+    df.to_csv(file_path, index = False)
+    full   = read_csv_with_json(file_path, json_cols = ['info'])
+    chunks = list(read_csv_with_json(file_path, json_cols = ['info'], chunksize = 2))
+    assert len(chunks) == 2
+    assert all(list(chunk.columns) == list(full.columns) for chunk in chunks)
+    pd.testing.assert_frame_equal(pd.concat(chunks), full, check_dtype = False)
+
+def test_read_csv_with_json_parallel(tmp_path):
+    file_path = str(tmp_path / 'data.csv')
+    df = pd.DataFrame({'id': [1, 2, 3], 
+        'info': ['{"a": 1, "b": "x"}', '{"a": 2}', '{"c": 3.5}'],
+        'meta': ['{"d": {"e": 1}}', '{"d": {"e": 2}}', '{}']})
+    df.to_csv(file_path, index = False)
+    serial   = read_csv_with_json(file_path, json_cols = ['info', 'meta'])
+    parallel = read_csv_with_json(file_path, json_cols = ['info', 'meta'], decoder = 'auto', n_jobs = 2)
+    pd.testing.assert_frame_equal(serial, parallel)
+    assert list(parallel.columns) == ['id', 'info_a', 'info_b', 'info_c', 'meta_d.e']
+
+def test_snapshot_version_npz(tmp_path):
+    file_path = str(tmp_path / 'data.npz')
+    df = pd.DataFrame({'age': [27, np.nan, 30], 
+        'gender': pd.Categorical(['female', 'male', np.nan]),
+        'income': ['high', np.nan, 'low'],
+        'tfidf': pd.arrays.SparseArray([0.0, 0.5, 0.0], fill_value = 0.0)})
+    assert save_snapshot_version(file_path, df).endswith('data_v1.npz')
+    assert save_snapshot_version(file_path, df.head(2)).endswith('data_v2.npz')
+    pd.testing.assert_frame_equal(load_snapshot_version(file_path, version = 1), df)
+    assert load_snapshot_version(file_path).shape == (2, 4)
+
+def test_snapshot_version_npz_nullable(tmp_path):
+    file_path = str(tmp_path / 'data.npz')
+    df = pd.DataFrame({'count': pd.array([1, None, 3], dtype = 'Int64'), 
+        'share': pd.array([0.5, None, 1.0], dtype = 'Float64'), 
+        'flag': pd.array([True, None, False], dtype = 'boolean'), 
+        'name': pd.array(['a', None, 'c'], dtype = 'string')})
+    save_snapshot_version(file_path, df)
+    pd.testing.assert_frame_equal(load_snapshot_version(file_path), df)
+
+def test_snapshot_version_npz_names(tmp_path):
+    file_path = str(tmp_path / 'data.npz')
+    df = pd.DataFrame([[1, 2.5, 'a'], [3, 4.5, 'b']], 
+                      columns = pd.MultiIndex.from_tuples([('a', 'x'), ('b', 'y'), ('b', 'z')], names = ['group', 'stat']))
+    save_snapshot_version(file_path, df)
+    pd.testing.assert_frame_equal(load_snapshot_version(file_path), df)
+    df = pd.DataFrame({('a', 1): [1], 0: [2]})
+    save_snapshot_version(file_path, df)
+    pd.testing.assert_frame_equal(load_snapshot_version(file_path), df)
+    df = pd.DataFrame({pd.Timestamp('2020-01-01'): [1.0]})
+    with pytest.raises(ValueError):
+        save_snapshot_version(file_path, df)
+
+def test_snapshot_version_parquet(tmp_path):
+    pytest.importorskip('pyarrow')
+    file_path = str(tmp_path / 'data.parquet')
+    df = pd.DataFrame({'age': [27, np.nan, 30], 
+        'gender': pd.Categorical(['female', 'male', np.nan]),
+        'tfidf': pd.arrays.SparseArray([0.0, 0.5, 0.0], fill_value = 0.0)})
+    save_snapshot_version(file_path, df)
+    pd.testing.assert_frame_equal(load_snapshot_version(file_path), df)
+
+def test_save_csv_version_concurrent(tmp_path):
+    file_path = str(tmp_path / 'data.csv')
+    df = pd.DataFrame({'age': [27, np.nan, 30]})
+    save_csv_version(file_path, df, min_version = 3)
+    with ThreadPoolExecutor(max_workers = 4) as executor:
+        paths = list(executor.map(lambda i: save_csv_version(file_path, df, index = False), range(8)))
+    assert len(set(paths)) == 8
+    assert sorted(os.listdir(str(tmp_path))) == sorted('data_v{}.csv'.format(k) for k in range(1, 10))
+
+def test_save_csv_version_compressed(tmp_path):
+    file_path = str(tmp_path / 'data.csv.gz')
+    df = pd.DataFrame({'age': [27, np.nan, 30]})
+    assert save_csv_version(file_path, df, index = False).endswith('data_v1.csv.gz')
+    assert save_csv_version(file_path, df, index = False).endswith('data_v2.csv.gz')
+    pd.testing.assert_frame_equal(pd.read_csv(str(tmp_path / 'data_v2.csv.gz')), df)
+
+def test_save_csv_version_skip_duplicates(tmp_path):
+    file_path = str(tmp_path / 'data.csv')
+    df = pd.DataFrame({'age': [27, np.nan, 30], 
+        'gender': ['female', 'male', np.nan]})
+    path_1 = save_csv_version(file_path, df, skip_duplicates = True, index = False)
+    path_2 = save_csv_version(file_path, df, skip_duplicates = True, index = False)
+    path_3 = save_csv_version(file_path, df.head(2), skip_duplicates = True, index = False)
+    assert path_1 == path_2
+    assert path_3.endswith('data_v2.csv')
+    assert find_matching_version(file_path, df) == path_1
+    assert find_matching_version(file_path, df.tail(1)) is None
+
+def test_save_csv_version_skip_duplicates_gaps(tmp_path):
+    file_path = str(tmp_path / 'data.csv')
+    df = pd.DataFrame({'age': [27, np.nan, 30]})
+    assert save_csv_version(file_path, df.head(1), min_version = 5, skip_duplicates = True).endswith('data_v5.csv')
+    path_1 = save_csv_version(file_path, df, skip_duplicates = True)
+    path_2 = save_csv_version(file_path, df, skip_duplicates = True)
+    assert path_1 == path_2
+    assert path_1.endswith('data_v1.csv')
+    assert save_csv_version(file_path, df.head(2)).endswith('data_v2.csv')
+    assert save_csv_version(file_path, df, skip_duplicates = True).endswith('data_v3.csv')